@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Compares the time taken to render large task listings as JSON the way
+# FastAPI does for a route with a response model with the time taken by
+# PorchJSONResponse, which serialises the models in one pass without
+# validating them. Also reports the size of the listings when gzipped.
+#
+# No database is needed, the tasks are built as the data access layer
+# builds them from database rows.
+#
+#   python benchmarks/json_responses.py --tasks 100000
+
+import argparse
+import gzip
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from npg_porch.endpoints.responses import PorchJSONResponse
+from npg_porch.models import Pipeline, Task, TaskExpanded, TaskStateEnum
+
+parser = argparse.ArgumentParser(
+    description="Benchmarks the rendering of task listings as JSON"
+)
+parser.add_argument(
+    "--tasks", type=int, default=100000, help="The number of tasks in a listing"
+)
+parser.add_argument(
+    "--repeat", type=int, default=3, help="The number of runs, the best is reported"
+)
+args = parser.parse_args()
+
+
+def make_tasks(task_class, n):
+    pipeline = Pipeline.model_construct(
+        name="ptest one", version="0.3.14", uri="https://pipeline-test.com"
+    )
+    created = datetime(2025, 1, 1)
+    tasks = []
+    for i in range(n):
+        init_args = {
+            "pipeline": pipeline,
+            "task_input_id": f"{i:064x}",
+            "task_input": {"id_run": 40000 + i, "position": i % 8 + 1},
+            "status": TaskStateEnum.PENDING,
+            "priority": 0,
+        }
+        if task_class is TaskExpanded:
+            init_args["created"] = created
+            init_args["updated"] = created + timedelta(seconds=i)
+        tasks.append(task_class.model_construct(**init_args))
+    return tasks
+
+
+def best_time(render):
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        body = render()
+        times.append(time.perf_counter() - start)
+    return (min(times), body)
+
+
+def report(name, baseline, render):
+    (baseline_time, baseline_body) = best_time(baseline)
+    (porch_time, porch_body) = best_time(render)
+    start = time.perf_counter()
+    # At the compression level of the server.
+    compressed = gzip.compress(porch_body, compresslevel=6)
+    gzip_time = time.perf_counter() - start
+    print(f"{name}, {args.tasks} tasks")
+    print(f"  response model   {baseline_time:8.3f}s  {len(baseline_body):>12,} bytes")
+    print(f"  one pass         {porch_time:8.3f}s  {len(porch_body):>12,} bytes")
+    print(f"  speedup          {baseline_time / porch_time:8.1f}x")
+    print(f"  gzipped          {gzip_time:8.3f}s  {len(compressed):>12,} bytes")
+
+
+tasks = make_tasks(Task, args.tasks)
+task_list = TypeAdapter(list[Task])
+report(
+    "GET /tasks",
+    # Validated against the response model, then dumped to JSON.
+    lambda: task_list.dump_json(task_list.validate_python(tasks)),
+    lambda: PorchJSONResponse(content=tasks).body,
+)
+
+expanded_tasks = make_tasks(TaskExpanded, args.tasks)
+report(
+    "GET /ui/tasks",
+    # The response model is a dict, which is encoded by jsonable_encoder.
+    lambda: JSONResponse(
+        content=jsonable_encoder({"draw": "1", "data": expanded_tasks})
+    ).body,
+    lambda: PorchJSONResponse(content={"draw": "1", "data": expanded_tasks}).body,
+)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+# Sets the last update time of tasks created before the task table had
+# the updated column. Safe to run repeatedly, only tasks without the time
+# are changed.
+
+import os
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from npg_porch.db.maintenance import backfill_task_updated
+
+db_url = os.environ.get('DB_URL')
+schema_name = os.environ.get('DB_SCHEMA')
+if schema_name is None:
+    schema_name = 'npg_porch'
+
+print(f'Backfilling the update time of tasks in schema {schema_name}')
+
+engine = sqlalchemy.create_engine(
+    db_url,
+    connect_args={'options': f'-csearch_path={schema_name}'}
+)
+
+with Session(engine) as session:
+    count = backfill_task_updated(session)
+
+print(f'Set the update time of {count} tasks')
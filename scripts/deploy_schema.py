@@ -2,22 +2,40 @@
 
 # Replace with Alembic in due course
 
+import argparse
+import logging
 import os
 import sqlalchemy
 
 import npg_porch.db.models
+from npg_porch.db.maintenance import upgrade_schema
+
+parser = argparse.ArgumentParser(
+    description='Deploys the npg_porch tables to the schema given by DB_SCHEMA'
+)
+parser.add_argument(
+    '--upgrade',
+    action='store_true',
+    help='Add missing columns and indexes to existing tables. Indexes are '
+    'built concurrently on a live database without blocking writes'
+)
+args = parser.parse_args()
 
 db_url = os.environ.get('DB_URL')
 schema_name = os.environ.get('DB_SCHEMA')
 if schema_name is None:
     schema_name = 'npg_porch'
 
-print(f'Deploying npg_porch tables to schema {schema_name}')
-
 engine = sqlalchemy.create_engine(
     db_url,
     connect_args={'options': f'-csearch_path={schema_name}'}
 )
 
 npg_porch.db.models.Base.metadata.schema = schema_name
-npg_porch.db.models.Base.metadata.create_all(engine)
+if args.upgrade:
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    print(f'Upgrading npg_porch tables in schema {schema_name}')
+    upgrade_schema(engine)
+else:
+    print(f'Deploying npg_porch tables to schema {schema_name}')
+    npg_porch.db.models.Base.metadata.create_all(engine)
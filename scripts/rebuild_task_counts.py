@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+# Recounts the tasks of each pipeline in each state. Run once after the
+# task_count table has been created, or if the counters are suspected to
+# be wrong. Changes to tasks wait while the tasks are counted.
+
+import os
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from npg_porch.db.maintenance import rebuild_task_counts
+
+db_url = os.environ.get('DB_URL')
+schema_name = os.environ.get('DB_SCHEMA')
+if schema_name is None:
+    schema_name = 'npg_porch'
+
+print(f'Rebuilding the task counters in schema {schema_name}')
+
+engine = sqlalchemy.create_engine(
+    db_url,
+    connect_args={'options': f'-csearch_path={schema_name}'}
+)
+
+with Session(engine) as session:
+    rebuild_task_counts(session)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+# Recomputes the duration statistics of the DONE tasks of each pipeline
+# from their events. Run once after the task_duration tables have been
+# created. Changes to tasks wait while the statistics are computed.
+
+import os
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from npg_porch.db.maintenance import rebuild_task_durations
+
+db_url = os.environ.get('DB_URL')
+schema_name = os.environ.get('DB_SCHEMA')
+if schema_name is None:
+    schema_name = 'npg_porch'
+
+print(f'Rebuilding the task duration statistics in schema {schema_name}')
+
+engine = sqlalchemy.create_engine(
+    db_url,
+    connect_args={'options': f'-csearch_path={schema_name}'}
+)
+
+with Session(engine) as session:
+    rebuild_task_durations(session)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import argparse
+from datetime import datetime
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
+
+from npg_porch.db.models import Token
+from npg_porch.db.notification import TOKEN_CHANNEL
+
+parser = argparse.ArgumentParser(
+    description='Revokes a token in the backend DB. Servers stop accepting '
+    'the token as soon as they are notified'
+)
+
+parser.add_argument(
+    '-H', '--host', help='Postgres host', required=True
+)
+parser.add_argument(
+    '-d', '--database', help='Postgres database', default='npg_porch'
+)
+parser.add_argument(
+    '-s', '--schema', help='Postgres schema', default='npg_porch'
+)
+parser.add_argument(
+    '-u', '--user', help='Postgres rw user', required=True
+)
+parser.add_argument(
+    '-p', '--password', help='Postgres rw password', required=True
+)
+parser.add_argument(
+    '-P', '--port', help='Postgres port', required=True
+)
+parser.add_argument(
+    '-t', '--token', help='The token to revoke', required=True
+)
+
+args = parser.parse_args()
+
+db_url = (
+    f'postgresql+psycopg2://{args.user}:{args.password}'
+    f'@{args.host}:{args.port}/{args.database}'
+)
+
+engine = create_engine(db_url, connect_args={'options': f'-csearch_path={args.schema}'})
+SessionFactory = sessionmaker(bind=engine)
+session = SessionFactory()
+
+try:
+    token = session.execute(
+        select(Token)
+        .where(Token.token == args.token)
+    ).scalar_one()
+except NoResultFound:
+    raise Exception('Token not found in database')
+
+if token.date_revoked is None:
+    token.date_revoked = datetime.now()
+# Delivered to the servers when the revocation is committed.
+session.execute(select(func.pg_notify(TOKEN_CHANNEL, str(token.token_id))))
+session.commit()
+
+print(f'Revoked token {token.token_id} ({token.description})')
+
+session.close()
+engine.dispose()
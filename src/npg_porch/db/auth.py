@@ -19,30 +19,100 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import threading
+import time
+from collections import OrderedDict
+
 from sqlalchemy import select
 from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm.exc import NoResultFound
 
 from npg_porch.db.models import Token
+from npg_porch.db.notification import TOKEN_CHANNEL, notifier
 from npg_porch.models.permission import Permission, RolesEnum
 
 __AUTH_TOKEN_LENGTH__ = 32
 __AUTH_TOKEN_REGEXP__ = re.compile(r"\A[0-9A-F]+\Z", flags=re.ASCII | re.IGNORECASE)
 
+# How long, in seconds, the permission of a token is cached, which bounds the
+# time a revoked token stays usable if the revocation is not notified.
+PERMISSION_CACHE_TTL = 60
+PERMISSION_CACHE_SIZE = 1000
+
 
 class CredentialsValidationException(Exception):
     pass
 
 
+class PermissionCache:
+    """
+    A least recently used cache of the permissions of valid tokens, each
+    kept for a limited time.
+
+    Only valid tokens are cached, so issuing a token needs no invalidation.
+    The permissions of a revoked token are dropped when the revocation is
+    notified on the token channel. Can be used from any thread.
+    """
+
+    def __init__(
+        self, ttl: float = PERMISSION_CACHE_TTL, size: int = PERMISSION_CACHE_SIZE
+    ):
+        self.ttl = ttl
+        self.size = size
+        self._permissions: OrderedDict[str, tuple[float, Permission]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Permission | None:
+        with self._lock:
+            entry = self._permissions.get(token)
+            if entry is None:
+                return None
+            (expires, permission) = entry
+            if expires < time.monotonic():
+                del self._permissions[token]
+                return None
+            self._permissions.move_to_end(token)
+            return permission
+
+    def put(self, token: str, permission: Permission):
+        with self._lock:
+            self._permissions[token] = (time.monotonic() + self.ttl, permission)
+            self._permissions.move_to_end(token)
+            while len(self._permissions) > self.size:
+                self._permissions.popitem(last=False)
+
+    def invalidate(self, token_id: int | None = None):
+        "Drops the permission of the token with the given ID, or all of them"
+        with self._lock:
+            if token_id is None:
+                self._permissions.clear()
+                return
+            for token, (_, permission) in list(self._permissions.items()):
+                if permission.requestor_id == token_id:
+                    del self._permissions[token]
+
+    def _revoked(self, payload: str):
+        try:
+            self.invalidate(int(payload))
+        except ValueError:
+            self.invalidate()
+
+
+permission_cache = PermissionCache()
+notifier.subscribe(TOKEN_CHANNEL, permission_cache._revoked)
+
+
 class Validator:
     """
     A validator for credentials presented by the requestor.
 
-    Instantiate with a sqlalchemy AsyncSession
+    Instantiate with a sqlalchemy AsyncSession. The permissions of valid
+    tokens are cached, see PermissionCache.
     """
 
-    def __init__(self, session):
+    def __init__(self, session, cache: PermissionCache = permission_cache):
         self.session = session
+        self.cache = cache
 
     async def token2permission(self, token: str):
         if len(token) != __AUTH_TOKEN_LENGTH__:
@@ -52,6 +122,10 @@ class Validator:
         elif __AUTH_TOKEN_REGEXP__.match(token) is None:
             raise CredentialsValidationException("Token failed character validation")
 
+        permission = self.cache.get(token)
+        if permission is not None:
+            return permission
+
         try:
             # Using 'outerjoin' to get the left join for token, pipeline.
             # We need to retrieve all token rows, regardless of whether
@@ -80,5 +154,6 @@ class Validator:
                 requestor_id=token_id,
                 pipeline=pipeline.convert_to_model(),
             )
+        self.cache.put(token, permission)
 
         return permission
@@ -18,13 +18,23 @@
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import logging
 import os
+from contextlib import asynccontextmanager
+from fastapi import Depends
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
 from npg_porch.db.models import Base
 from npg_porch.db.data_access import AsyncDbAccessor
 from npg_porch.db.auth import Validator
+from npg_porch.db.notification import (
+    PIPELINE_CHANNEL,
+    TASK_CHANNEL,
+    TOKEN_CHANNEL,
+    listen,
+)
 
 config = {
     "DB_URL": os.environ.get("DB_URL"),
@@ -32,6 +42,10 @@ config = {
     if os.environ.get("DB_SCHEMA")
     else "npg_porch",
     "TEST": os.environ.get("NPG_PORCH_MODE"),
+    # How often, in seconds, to look for tasks with expired leases.
+    "LEASE_REAPER_INTERVAL": float(
+        os.environ.get("NPG_PORCH_LEASE_REAPER_INTERVAL", 60)
+    ),
 }
 
 if config["TEST"]:
@@ -57,30 +71,99 @@ Base.metadata.schema = config["DB_SCHEMA"]
 session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
-async def get_DbAccessor():
+async def get_session():
+    """
+    Provides a hook for fastapi to Depend on the DB session of a request.
+
+    fastapi resolves the dependency once per request, so the Validator and
+    the AsyncDbAccessor of a request share this session and its transaction.
+    The session checks out a pooled connection only when it runs the first
+    statement, routes that do not use the database do not take one, nor do
+    requests authorised from the permission cache until the route runs a
+    statement.
+
+    The transaction is committed when the request has been handled, or
+    rolled back if the route raised an error.
+    """
+    async with session_factory() as session:
+        yield session
+        await session.commit()
+
+
+async def get_DbAccessor(session=Depends(get_session)):
     """
     Provides a hook for fastapi to Depend on a DB session in each route.
 
-    Yields an instance of AsyncDbAccessor class, which provides an API
-    for access to data.
+    Returns an instance of AsyncDbAccessor class, which provides an API
+    for access to data, using the session of the request (see get_session).
+
+    A transaction is started automatically by the first statement. The
+    accessor might commit before the end of the request, then a new
+    transaction is started by the next statement.
+    """
+    return AsyncDbAccessor(session)
+
 
-    Starts a transaction that finished automatically when the returned
-    object drops out of scope.
+@asynccontextmanager
+async def open_DbAccessor():
+    """
+    Yields an instance of AsyncDbAccessor class with a new DB session,
+    which is managed in the same way as the session of a request.
+
+    For use where the session of the route has ended, e.g. when the body of
+    a streaming response is generated.
     """
     async with session_factory() as session:
-        async with session.begin():
-            yield AsyncDbAccessor(session)
+        yield AsyncDbAccessor(session)
+        await session.commit()
 
 
-async def get_CredentialsValidator():
+async def get_CredentialsValidator(session=Depends(get_session)):
     """
-    Similar to get_DbAccessor, but yields an instance of the Validator class,
+    Similar to get_DbAccessor, but returns an instance of the Validator class,
     which provides methods for validating credentials submitted with the
     request.
     """
-    async with session_factory() as session:
-        async with session.begin():
-            yield Validator(session)
+    return Validator(session)
+
+
+def start_notification_listener() -> asyncio.Task | None:
+    """
+    On PostgreSQL, starts listening to notifications sent by all server
+    processes. Returns the listening asyncio task, which should be cancelled
+    on shutdown. Other databases do not need a listener.
+    """
+    if engine.dialect.name != "postgresql":
+        return None
+    return asyncio.create_task(
+        listen(engine, [TASK_CHANNEL, TOKEN_CHANNEL, PIPELINE_CHANNEL])
+    )
+
+
+async def reap_expired_leases(interval: float):
+    """
+    Periodically returns tasks with expired leases to the PENDING state.
+    Runs until cancelled. Every server process runs the reaper, a task is
+    only ever reaped once since its state is changed by the reaping query.
+    """
+    logger = logging.getLogger(__name__)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as session:
+                await AsyncDbAccessor(session).reap_expired_leases()
+        except Exception as e:
+            logger.error(f"Failed to reap expired leases: {e}")
+
+
+def start_lease_reaper() -> asyncio.Task:
+    """
+    Starts the lease reaper. Returns the reaper's asyncio task, which
+    should be cancelled on shutdown.
+    """
+    return asyncio.create_task(
+        reap_expired_leases(config["LEASE_REAPER_INTERVAL"])
+    )
 
 
 async def deploy_schema():
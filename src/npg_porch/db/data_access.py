@@ -18,25 +18,205 @@
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import logging
-from datetime import datetime
-from statistics import mean, stdev
+import threading
+from collections import Counter
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta
 
-from sqlalchemy import select, or_
+from sqlalchemy import (
+    DateTime,
+    String,
+    cast,
+    insert,
+    literal,
+    literal_column,
+    or_,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy.orm import aliased, contains_eager, joinedload
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.sql.functions import count, max as samax
+from sqlalchemy.sql.functions import count, func
 
 from npg_porch.db.models import Event
 from npg_porch.db.models import Pipeline as DbPipeline
 from npg_porch.db.models import Task as DbTask
+from npg_porch.db.models import TaskCount, TaskDuration, TaskDurationBucket
+from npg_porch.db.durations import (
+    DURATION_BUCKETS,
+    DurationSummary,
+    summarise_durations,
+)
 from npg_porch.db.models import Token as DbToken
+from npg_porch.db.notification import PIPELINE_CHANNEL, TASK_CHANNEL, notifier
 from npg_porch.models import Pipeline, Task, TaskStateEnum, TaskExpanded
+from npg_porch.models.task import (
+    PipelineStats,
+    TaskCreationResult,
+    TaskDurationStats,
+    TaskLease,
+    TaskStateTransitionException,
+    TaskUpdateResult,
+    allowed_previous_states,
+    generate_task_input_id,
+    is_allowed_transition,
+)
 from npg_porch.models.token import Token
 
 old_pipelines = ["Test pipeline 1", "Snakemake_Cardinal"]
 
+# Tasks in these states can have a lease, which is cleared by other changes.
+LEASED_STATES = (TaskStateEnum.CLAIMED, TaskStateEnum.RUNNING)
+
+# The number of rows in a multi-row statement, keeps the number of bind
+# parameters well within the limits of the databases.
+BULK_CHUNK_SIZE = 1000
+
+# The number of rows fetched at a time from a server-side cursor.
+STREAM_BATCH_SIZE = 1000
+
+# Tasks that are not done are long running once they have taken this many
+# standard deviations more than the mean duration of the done tasks of their
+# pipeline.
+LONG_RUNNING_STDEVS = 2
+
+
+def _state_literal(state: TaskStateEnum):
+    """
+    Returns the state as an SQL literal rather than a bind parameter. The
+    generic plan of a prepared statement comparing the state with a
+    parameter cannot use a partial index whose predicate names the state.
+    """
+    return literal_column(f"'{state.value}'", String)
+
+
+def _chunks(items: list, size: int = BULK_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# Columns of the fields of the Task and TaskExpanded models, used to select
+# only the requested fields of tasks.
+_TASK_FIELD_COLUMNS = {
+    "task_input_id": DbTask.job_descriptor,
+    "task_input": DbTask.definition,
+    "status": DbTask.state,
+    "priority": DbTask.priority,
+    "created": DbTask.created,
+    "updated": DbTask.updated,
+}
+_PIPELINE_FIELD_COLUMNS = {
+    "name": DbPipeline.name,
+    "uri": DbPipeline.repository_uri,
+    "version": DbPipeline.version,
+}
+
+
+# Columns of the fields of the TaskExpanded model that tables of tasks can
+# be ordered by.
+_EXPANDED_TASK_ORDER_COLUMNS = {
+    "pipeline.name": DbPipeline.name,
+    "pipeline.version": DbPipeline.version,
+    "task_input_id": DbTask.job_descriptor,
+    "status": DbTask.state,
+    "priority": DbTask.priority,
+    "created": DbTask.created,
+    "updated": DbTask.updated,
+}
+
+
+def _task_field_columns(fields: list[str]) -> list:
+    "Returns the labelled columns for the given fields and the task_id"
+    columns = [DbTask.task_id]
+    for field in fields:
+        if field == "pipeline":
+            columns.extend(
+                column.label(f"pipeline_{name}")
+                for (name, column) in _PIPELINE_FIELD_COLUMNS.items()
+            )
+        else:
+            columns.append(_TASK_FIELD_COLUMNS[field].label(field))
+    return columns
+
+
+def _task_fields(row, fields: list[str]) -> dict:
+    "Returns the given fields of a row selected by _task_field_columns"
+    values = row._mapping
+    task = {}
+    for field in fields:
+        if field == "pipeline":
+            task[field] = {
+                name: values[f"pipeline_{name}"] for name in _PIPELINE_FIELD_COLUMNS
+            }
+        else:
+            task[field] = values[field]
+    return task
+
+
+def _convert_tasks(
+    db_tasks, task_class: type[Task | TaskExpanded] = Task
+) -> list[Task] | list[TaskExpanded]:
+    "Converts tasks to models, tasks of a pipeline share one pipeline model"
+    pipelines = {}
+    models = []
+    for t in db_tasks:
+        pipeline = pipelines.get(t.pipeline_id)
+        if pipeline is None:
+            pipeline = pipelines[t.pipeline_id] = t.pipeline.convert_to_model()
+        models.append(t.convert_to_model(task_class, pipeline=pipeline))
+    return models
+
+
+def _transition_failure(
+    state: TaskStateEnum,
+    new_status: TaskStateEnum,
+    expected_status: TaskStateEnum | None = None,
+) -> str:
+    if expected_status is not None and state != expected_status:
+        return f"Task status is {state}, not {expected_status}"
+    return f"Cannot change task status from {state} to {new_status}"
+
+
+class PipelineCache:
+    """
+    The IDs and models of pipelines by name, shared by the accessors of a
+    process.
+
+    Pipelines are not expected to change once created. Should they change,
+    a notification on the pipeline channel drops the cached pipeline. Can be
+    used from any thread.
+    """
+
+    def __init__(self):
+        self._pipelines: dict[str, tuple[int, Pipeline]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> tuple[int, Pipeline] | None:
+        with self._lock:
+            return self._pipelines.get(name)
+
+    def put(self, name: str, pipeline_id: int, pipeline: Pipeline):
+        with self._lock:
+            self._pipelines[name] = (pipeline_id, pipeline)
+
+    def invalidate(self, name: str | None = None):
+        "Drops the pipeline with the given name, or all of them"
+        with self._lock:
+            if name is None:
+                self._pipelines.clear()
+            else:
+                self._pipelines.pop(name, None)
+
+
+pipeline_cache = PipelineCache()
+notifier.subscribe(PIPELINE_CHANNEL, pipeline_cache.invalidate)
+
 
 class AsyncDbAccessor:
     """
@@ -48,10 +228,165 @@ class AsyncDbAccessor:
     def __init__(self, session):
         self.session = session
         self.logger = logging.getLogger(__name__)
+        self._notifications = set()
+        self._task_counts = Counter()
+        self._durations = {}
+
+    def _notify(self, channel: str, payload: str):
+        "Schedules a notification to be sent when the transaction is committed"
+        self._notifications.add((channel, payload))
+
+    def _count_transition(
+        self,
+        pipeline_id: int,
+        old_state: TaskStateEnum | None,
+        new_state: TaskStateEnum,
+        n: int = 1,
+    ):
+        """
+        Schedules the change of the task counters for n tasks of a pipeline
+        moving from the old to the new state, or being created if the old
+        state is None. The counters are changed when the transaction is
+        committed.
+        """
+        if old_state == new_state:
+            return
+        if old_state is not None:
+            self._task_counts[(pipeline_id, str(old_state))] -= n
+        self._task_counts[(pipeline_id, str(new_state))] += n
+
+    async def _apply_task_counts(self, task_counts: Counter):
+        """
+        Adds the changes to the task counters with one upsert. The counter
+        rows are locked in a fixed order so that concurrent transactions
+        changing the same counters cannot deadlock.
+        """
+        rows = [
+            {"pipeline_id": pipeline_id, "state": state, "n": n}
+            for ((pipeline_id, state), n) in sorted(task_counts.items())
+            if n != 0
+        ]
+        if rows:
+            statement = self._insert(TaskCount).values(rows)
+            await self.session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=["pipeline_id", "state"],
+                    set_={"n": TaskCount.n + statement.excluded.n},
+                )
+            )
+
+    def _record_duration(
+        self,
+        pipeline_id: int,
+        old_state: TaskStateEnum,
+        new_state: TaskStateEnum,
+        created: datetime,
+        updated: datetime,
+    ):
+        """
+        Schedules adding the duration of a task that has become DONE to the
+        duration statistics of its pipeline. The statistics are changed when
+        the transaction is committed.
+        """
+        if new_state == TaskStateEnum.DONE and old_state != TaskStateEnum.DONE:
+            self._durations.setdefault(pipeline_id, []).append(
+                (updated - created).total_seconds()
+            )
+
+    async def _apply_durations(self, durations: dict[int, list[float]]):
+        """
+        Merges the summaries of the new durations into the duration statistics
+        of the pipelines with one upsert, and adds them to the histograms with
+        another. Rows are locked in a fixed order as for the task counters.
+        """
+        if not durations:
+            return
+        summaries = []
+        buckets = Counter()
+        for pipeline_id in sorted(durations):
+            (summary, pipeline_buckets) = summarise_durations(durations[pipeline_id])
+            summaries.append(
+                {
+                    "pipeline_id": pipeline_id,
+                    "n": summary.n,
+                    "mean": summary.mean,
+                    "m2": summary.m2,
+                }
+            )
+            buckets.update(
+                {(pipeline_id, bucket): n for (bucket, n) in pipeline_buckets.items()}
+            )
+
+        # Chan et al.'s formulae for merging the statistics of two samples,
+        # evaluated on the old values of the row.
+        statement = self._insert(TaskDuration).values(summaries)
+        new = statement.excluded
+        n = TaskDuration.n + new.n
+        delta = new.mean - TaskDuration.mean
+        await self.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["pipeline_id"],
+                set_={
+                    "n": n,
+                    "mean": TaskDuration.mean + delta * new.n / n,
+                    "m2": TaskDuration.m2
+                    + new.m2
+                    + delta * delta * TaskDuration.n * new.n / n,
+                },
+            )
+        )
+        statement = self._insert(TaskDurationBucket).values(
+            [
+                {"pipeline_id": pipeline_id, "bucket": bucket, "n": n}
+                for ((pipeline_id, bucket), n) in sorted(buckets.items())
+            ]
+        )
+        await self.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["pipeline_id", "bucket"],
+                set_={"n": TaskDurationBucket.n + statement.excluded.n},
+            )
+        )
+
+    async def _commit(self):
+        """
+        Commits the session's transaction, changing the task counters and
+        duration statistics and sending notifications scheduled within it.
+        """
+        task_counts, self._task_counts = self._task_counts, Counter()
+        await self._apply_task_counts(task_counts)
+        durations, self._durations = self._durations, {}
+        await self._apply_durations(durations)
+        notifications, self._notifications = self._notifications, set()
+        postgres = self.session.bind.dialect.name == "postgresql"
+        if postgres:
+            # Delivered to the listeners of all processes on commit.
+            for channel, payload in notifications:
+                await self.session.execute(select(func.pg_notify(channel, payload)))
+        await self.session.commit()
+        if not postgres:
+            for channel, payload in notifications:
+                notifier.notify(channel, payload)
 
     async def get_pipeline_by_name(self, name: str) -> Pipeline:
-        pipeline = await self._get_pipeline_db_object(name)
-        return pipeline.convert_to_model()
+        (_, pipeline) = await self._get_pipeline(name)
+        return pipeline.model_copy()
+
+    async def _get_pipeline(self, name: str) -> tuple[int, Pipeline]:
+        """
+        Returns the ID and the model of the pipeline with the given name from
+        the pipeline cache, looking the pipeline up on a cache miss.
+
+        Raises NoResultFound if there is no such pipeline. The cached model is
+        shared, it should not be changed.
+        """
+        cached = pipeline_cache.get(name)
+        if cached is not None:
+            return cached
+        db_pipeline = await self._get_pipeline_db_object(name)
+        pipeline = db_pipeline.convert_to_model()
+        pipeline_cache.put(name, db_pipeline.pipeline_id, pipeline)
+        return (db_pipeline.pipeline_id, pipeline)
 
     async def _get_pipeline_db_object(self, name: str) -> Pipeline:
         pipeline_result = await self.session.execute(
@@ -102,7 +437,8 @@ class AsyncDbAccessor:
         )
 
         session.add(pipe)
-        await session.commit()
+        self._notify(PIPELINE_CHANNEL, pipe.name)
+        await self._commit()
         return pipe.convert_to_model()
 
     async def create_pipeline_token(self, name: str, desc: str) -> Token:
@@ -126,17 +462,17 @@ class AsyncDbAccessor:
         """
         self.logger.debug("CREATE TASK: " + str(task))
         session = self.session
-        db_pipeline = await self._get_pipeline_db_object(task.pipeline.name)
+        (pipeline_id, pipeline) = await self._get_pipeline(task.pipeline.name)
 
         task.status = TaskStateEnum.PENDING
-        t = self.convert_task_to_db(task, db_pipeline)
+        t = self.convert_task_to_db(task, pipeline_id)
         created = True
         try:
             nested = await session.begin_nested()
             session.add(t)
             event = Event(task=t, token_id=token_id, change="Created")
             t.events.append(event)
-            await session.commit()
+            await session.flush()
         except IntegrityError:
             await nested.rollback()
             # Task already exists, query the database to get the up-to-date
@@ -145,179 +481,1023 @@ class AsyncDbAccessor:
                 pipeline_name=task.pipeline.name, job_descriptor=t.job_descriptor
             )
             created = False
+        else:
+            # Counted and notified only once the task has been inserted.
+            self._count_transition(pipeline_id, None, t.state)
+            self._notify(TASK_CHANNEL, pipeline.name)
+            await self._commit()
+
+        return (t.convert_to_model(pipeline=pipeline), created)
+
+    async def create_tasks(
+        self, token_id: int, pipeline_name: str, tasks: list[Task]
+    ) -> list[TaskCreationResult]:
+        """
+        Given task definitions for a pipeline creates the tasks that do not
+        exist yet.
+
+        The tasks are inserted with multi-row INSERT ... ON CONFLICT DO NOTHING
+        statements, the events for the created tasks are inserted in bulk.
+        Already existing tasks are fetched in bulk.
 
-        return (t.convert_to_model(), created)
+        Returns a result for each of the given tasks, in the same order, with
+        the Task object for the database record and a flag telling whether
+        the task was created. If the same task is given more than once, only
+        the first occurrence is reported as created.
+        """
+        session = self.session
+        (pipeline_id, pipeline) = await self._get_pipeline(pipeline_name)
+
+        task_ids = [task.generate_task_id() for task in tasks]
+        rows = {}
+        for task_id, task in zip(task_ids, tasks):
+            rows.setdefault(
+                task_id,
+                {
+                    "pipeline_id": pipeline_id,
+                    "job_descriptor": task_id,
+                    "definition": task.task_input,
+                    "state": TaskStateEnum.PENDING,
+                    "priority": task.priority or 0,
+                },
+            )
+
+        db_tasks = {}
+        for chunk in _chunks(list(rows.values())):
+            result = await session.execute(
+                self._insert(DbTask)
+                .values(chunk)
+                .on_conflict_do_nothing(
+                    index_elements=["pipeline_id", "job_descriptor"]
+                )
+                .returning(DbTask)
+            )
+            db_tasks.update((t.job_descriptor, t) for t in result.scalars())
+        created_ids = set(db_tasks.keys())
+        await self._log_events(
+            token_id, [db_tasks[i].task_id for i in created_ids], "Created"
+        )
+        if created_ids:
+            self._count_transition(
+                pipeline_id, None, TaskStateEnum.PENDING, len(created_ids)
+            )
+            self._notify(TASK_CHANNEL, pipeline.name)
+        await self._commit()
+
+        existing_ids = [i for i in rows.keys() if i not in created_ids]
+        for chunk in _chunks(existing_ids):
+            result = await session.execute(
+                select(DbTask)
+                .where(DbTask.pipeline_id == pipeline_id)
+                .where(DbTask.job_descriptor.in_(chunk))
+            )
+            db_tasks.update((t.job_descriptor, t) for t in result.scalars())
+
+        results = []
+        models = {}
+        for task_id in task_ids:
+            if task_id not in models:
+                models[task_id] = db_tasks[task_id].convert_to_model(
+                    pipeline=pipeline
+                )
+                created = task_id in created_ids
+            else:
+                created = False
+            results.append(TaskCreationResult(task=models[task_id], created=created))
+        return results
+
+    async def get_registered_task_ids(
+        self, pipeline_name: str, task_input_ids: list[str]
+    ) -> set[str]:
+        """
+        Given task input IDs for a pipeline returns the IDs of the tasks
+        that exist.
+
+        The existence of the tasks is checked in batches using the unique
+        index on the pipeline and the task input ID, only the IDs are
+        retrieved. Nothing is written to the database.
+        """
+        (pipeline_id, _) = await self._get_pipeline(pipeline_name)
+
+        registered = set()
+        for chunk in _chunks(list(set(task_input_ids))):
+            result = await self.session.execute(
+                select(DbTask.job_descriptor)
+                .where(DbTask.pipeline_id == pipeline_id)
+                .where(DbTask.job_descriptor.in_(chunk))
+            )
+            registered.update(result.scalars())
+        return registered
 
     async def claim_tasks(
-        self, token_id: int, pipeline: Pipeline, claim_limit: int | None = 1
+        self,
+        token_id: int,
+        pipeline: Pipeline,
+        claim_limit: int | None = 1,
+        skip_locked: bool = True,
+        wait: float = 0,
+        lease: int | None = None,
+    ) -> list[Task]:
+        """
+        Claims up to claim_limit PENDING tasks of the pipeline, highest
+        priority first and oldest first within the same priority.
+
+        By default the candidate rows are locked with FOR UPDATE SKIP LOCKED,
+        so that concurrent claimers do not queue behind each other's row
+        locks, each of them getting a disjoint batch of tasks. Set skip_locked
+        to False to wait for the locks held by other claimers instead.
+
+        Databases without row-level locking (SQLite) do not render FOR UPDATE.
+        For them, and as a safety net in general, the state change is applied
+        only to the candidate rows that are still PENDING, so a task can never
+        be claimed twice.
+
+        Whatever the number of tasks, the claim takes a constant number of
+        statements.
+
+        If no tasks can be claimed, waits for up to the given number of seconds
+        for tasks of this pipeline to become PENDING and claims them. Waiting
+        does not query the database, the claim is retried when a notification
+        about new PENDING tasks for the pipeline is received. The transaction
+        is committed before waiting.
+
+        If the lease duration in seconds is given, the claimed tasks that are
+        not finished and whose lease is not extended (see extend_lease) within
+        this time are returned to the PENDING state by reap_expired_leases.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while True:
+            with notifier.waiter(TASK_CHANNEL, pipeline.name) as woken:
+                tasks = await self._claim_tasks(
+                    token_id, pipeline, claim_limit, skip_locked, lease
+                )
+                timeout = deadline - loop.time()
+                if tasks or timeout <= 0:
+                    return tasks
+                try:
+                    await asyncio.wait_for(woken, timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _claim_tasks(
+        self,
+        token_id: int,
+        pipeline: Pipeline,
+        claim_limit: int | None,
+        skip_locked: bool,
+        lease: int | None,
     ) -> list[Task]:
         session = self.session
+        lease_expires = (
+            None if lease is None else datetime.now() + timedelta(seconds=lease)
+        )
 
         try:
-            pipeline_result = await session.execute(
-                select(DbPipeline).filter_by(name=pipeline.name)
-            )
-            pipeline = pipeline_result.scalar_one()
+            (pipeline_id, pipeline) = await self._get_pipeline(pipeline.name)
         except NoResultFound:
             raise NoResultFound("Pipeline not found")
 
-        potential_tasks = await session.execute(
-            select(DbTask)
-            .join(DbTask.pipeline)
-            .where(DbPipeline.name == pipeline.name)
-            .where(DbTask.state == TaskStateEnum.PENDING)
-            .order_by(DbTask.created)
-            .options(contains_eager(DbTask.pipeline))
-            .with_for_update()
-            .limit(claim_limit)
-            .execution_options(populate_existing=True)
-        )
-
-        claimed_tasks = potential_tasks.scalars().all()
+        # The candidate rows are selected, locked, flipped to CLAIMED and
+        # returned by a single UPDATE statement. The events are then added
+        # in bulk by one INSERT statement regardless of the number of tasks.
         try:
-            for task in claimed_tasks:
-                task.state = TaskStateEnum.CLAIMED
-                event = Event(change="Task claimed", token_id=token_id, task=task)
-                session.add(event)
-            await session.commit()
+            claimed = await session.execute(
+                update(DbTask)
+                .where(
+                    DbTask.task_id.in_(
+                        self._claim_candidates_query(
+                            pipeline_id, claim_limit, skip_locked
+                        )
+                    )
+                )
+                .where(DbTask.state == _state_literal(TaskStateEnum.PENDING))
+                .values(
+                    state=TaskStateEnum.CLAIMED,
+                    lease_expires=lease_expires,
+                    updated=func.now(),
+                )
+                .returning(DbTask)
+                .execution_options(populate_existing=True)
+            )
+            claimed_tasks = claimed.scalars().all()
+            await self._log_events(
+                token_id, [t.task_id for t in claimed_tasks], "Task claimed"
+            )
+            self._count_transition(
+                pipeline_id,
+                TaskStateEnum.PENDING,
+                TaskStateEnum.CLAIMED,
+                len(claimed_tasks),
+            )
+            await self._commit()
         except IntegrityError as e:
             self.logger.info(e)
             await session.rollback()
             return []
 
-        work = []
-        for task in claimed_tasks:
-            work.append(task.convert_to_model())
-        return work
+        # RETURNING does not guarantee any order.
+        claimed_tasks = sorted(
+            claimed_tasks, key=lambda t: (-t.priority, t.created, t.task_id)
+        )
+        return [task.convert_to_model(pipeline=pipeline) for task in claimed_tasks]
+
+    @staticmethod
+    def _claim_candidates_query(
+        pipeline_id: int, claim_limit: int | None, skip_locked: bool = True
+    ):
+        """
+        Returns a query selecting the ids of PENDING tasks of the pipeline
+        in the order they should be claimed. Only the task rows are locked,
+        the pipeline row has to stay available to other claimers.
 
-    async def update_task(self, token_id: int, task: Task) -> Task:
+        The query is served by the partial idx_claimable_tasks index.
         """
-        Allows the modification of state of a task.
+        return (
+            select(DbTask.task_id)
+            .where(DbTask.pipeline_id == pipeline_id)
+            .where(DbTask.state == _state_literal(TaskStateEnum.PENDING))
+            .order_by(DbTask.priority.desc(), DbTask.created, DbTask.task_id)
+            .with_for_update(of=DbTask, skip_locked=skip_locked)
+            .limit(claim_limit)
+        )
+
+    def _insert(self, table):
+        "Returns an INSERT statement supporting ON CONFLICT clauses"
+        if self.session.bind.dialect.name == "postgresql":
+            return postgresql_insert(table)
+        return sqlite_insert(table)
+
+    async def _log_events(self, token_id: int, task_ids: list[int], change: str):
+        "Records the same change for a number of tasks with one bulk INSERT"
+        if task_ids:
+            await self.session.execute(
+                insert(Event),
+                [
+                    {"task_id": task_id, "token_id": token_id, "change": change}
+                    for task_id in task_ids
+                ],
+            )
+
+    async def update_task(
+        self,
+        token_id: int,
+        task: Task,
+        expected_status: TaskStateEnum | None = None,
+    ) -> Task:
+        """
+        Allows the modification of state and, optionally, priority of a task.
         Other fields cannot be changed.
+
+        The task is only changed if the transition from its current state is
+        allowed and, if the expected status is given, the task is in this
+        state. The check and the change are made by one UPDATE statement.
+
+        Raises NoResultFound if the task does not exist and
+        TaskStateTransitionException if its state does not allow the change.
         """
-        session = self.session
-        # Get the matching task from the DB
         try:
-            db_pipe = await self._get_pipeline_db_object(task.pipeline.name)
+            (pipeline_id, pipeline) = await self._get_pipeline(task.pipeline.name)
         except NoResultFound:
             raise NoResultFound("Pipeline not found")
 
-        try:
-            task_result = await session.execute(
-                select(DbTask)
-                .filter_by(pipeline=db_pipe)
-                .filter_by(job_descriptor=task.generate_task_id())
+        new_status = task.status
+        job_descriptor = task.generate_task_id()
+        # The status might be the same as the old one, but save and log
+        # nevertheless in case we have some heart beat status in future.
+        values = {"state": new_status, "updated": func.now()}
+        if task.priority is not None:
+            values["priority"] = task.priority
+        if new_status not in LEASED_STATES:
+            values["lease_expires"] = None
+        changed = await self._transition(
+            [
+                DbTask.pipeline_id == pipeline_id,
+                DbTask.job_descriptor == job_descriptor,
+                self._transition_condition(new_status, expected_status),
+            ],
+            values,
+            DbTask,
+            populate_existing=True,
+        )
+        if not changed:
+            await self._raise_update_failure(
+                pipeline_id, job_descriptor, new_status, expected_status
             )
-            og_task = task_result.scalar_one()  # Doesn't raise exception if no rows?!
-        except NoResultFound:
+        ((row, old_state),) = changed
+        og_task = row[0]
+        await self._log_events(
+            token_id, [og_task.task_id], f"Task changed, new status {new_status}"
+        )
+        self._count_transition(pipeline_id, old_state, new_status)
+        self._record_duration(
+            pipeline_id, old_state, new_status, og_task.created, og_task.updated
+        )
+        if new_status == TaskStateEnum.PENDING:
+            self._notify(TASK_CHANNEL, pipeline.name)
+        await self._commit()
+
+        return og_task.convert_to_model(pipeline=pipeline)
+
+    async def _transition(
+        self, criteria: list, values: dict, *returning, **execution_options
+    ) -> list[tuple]:
+        """
+        Changes the tasks that match the criteria with one UPDATE statement.
+        Returns a (row, old state) pair for each changed task, where the row
+        has the given columns and the old state is the state of the task
+        before the change.
+
+        On PostgreSQL the tasks are selected and locked by a common table
+        expression of the UPDATE statement, which keeps their old state.
+        Since the tasks are locked before they are changed, the old state
+        cannot be changed by a concurrent transaction in between. SQLite does
+        not allow other tables in RETURNING, the old states are read first,
+        the transaction then holds the database lock so that no other writer
+        can change them.
+        """
+        if self.session.bind.dialect.name == "postgresql":
+            old_tasks = (
+                select(DbTask.task_id, DbTask.state.label("old_state"))
+                .where(*criteria)
+                .with_for_update(of=DbTask)
+                .cte("old_tasks")
+            )
+            result = await self.session.execute(
+                update(DbTask)
+                .where(DbTask.task_id == old_tasks.c.task_id)
+                .values(**values)
+                .returning(*returning, old_tasks.c.old_state)
+                .add_cte(old_tasks)
+                .execution_options(**execution_options)
+            )
+            return [(row, row.old_state) for row in result]
+
+        result = await self.session.execute(
+            select(DbTask.task_id, DbTask.state).where(*criteria)
+        )
+        old_states = {row.task_id: row.state for row in result}
+        if not old_states:
+            return []
+        result = await self.session.execute(
+            update(DbTask)
+            .where(DbTask.task_id.in_(old_states))
+            .values(**values)
+            .returning(*returning, DbTask.task_id.label("transition_task_id"))
+            .execution_options(**execution_options)
+        )
+        return [
+            (row, old_states[row._mapping["transition_task_id"]]) for row in result
+        ]
+
+    @staticmethod
+    def _transition_condition(
+        new_status: TaskStateEnum, expected_status: TaskStateEnum | None = None
+    ):
+        """
+        Returns the condition on the current state of a task to be moved to
+        the new state.
+        """
+        if expected_status is None:
+            return DbTask.state.in_(allowed_previous_states(new_status))
+        if not is_allowed_transition(expected_status, new_status):
+            raise TaskStateTransitionException(
+                f"Cannot change task status from {expected_status} to {new_status}"
+            )
+        return DbTask.state == expected_status
+
+    async def _raise_update_failure(
+        self,
+        pipeline_id,
+        job_descriptor: str,
+        new_status: TaskStateEnum,
+        expected_status: TaskStateEnum | None = None,
+    ):
+        """
+        Raises the exception explaining why a conditional update of a task
+        did not change it. Only called once the update has failed.
+        """
+        result = await self.session.execute(
+            select(DbTask.state)
+            .where(DbTask.pipeline_id == pipeline_id)
+            .where(DbTask.job_descriptor == job_descriptor)
+        )
+        state = result.scalar_one_or_none()
+        if state is None:
             raise NoResultFound("Task to be modified could not be found")
+        raise TaskStateTransitionException(
+            _transition_failure(state, new_status, expected_status)
+        )
 
-        new_status = task.status
-        # Might be the same as the old one, but save and log nevertheless
-        # in case we have some heart beat status in future.
-        og_task.state = new_status
-        event = Event(
-            change=f"Task changed, new status {new_status}",
-            token_id=token_id,
-            task=og_task,
-        )
-        session.add(event)
-        await session.commit()
+    async def update_task_status(
+        self,
+        token_id: int,
+        pipeline_name: str,
+        task_input_id: str,
+        new_status: TaskStateEnum,
+        expected_status: TaskStateEnum | None = None,
+    ) -> TaskUpdateResult:
+        """
+        Changes the status of the task with the given task input ID with one
+        UPDATE statement, which uses the unique index on the pipeline and the
+        task input ID. The change is recorded as an event.
+
+        The state transition is checked as in update_task. Raises
+        NoResultFound if the pipeline has no such task and
+        TaskStateTransitionException if its state does not allow the change.
+        """
+        pipeline_id = (
+            select(DbPipeline.pipeline_id)
+            .where(DbPipeline.name == pipeline_name)
+            .scalar_subquery()
+        )
+        values = {"state": new_status, "updated": func.now()}
+        if new_status not in LEASED_STATES:
+            values["lease_expires"] = None
+        changed = await self._transition(
+            [
+                DbTask.pipeline_id == pipeline_id,
+                DbTask.job_descriptor == task_input_id,
+                self._transition_condition(new_status, expected_status),
+            ],
+            values,
+            DbTask.task_id,
+            DbTask.pipeline_id,
+            DbTask.created,
+            DbTask.updated,
+            synchronize_session=False,
+        )
+        if not changed:
+            await self._raise_update_failure(
+                pipeline_id, task_input_id, new_status, expected_status
+            )
+        ((row, old_state),) = changed
+        await self._log_events(
+            token_id, [row.task_id], f"Task changed, new status {new_status}"
+        )
+        self._count_transition(row.pipeline_id, old_state, new_status)
+        self._record_duration(
+            row.pipeline_id, old_state, new_status, row.created, row.updated
+        )
+        if new_status == TaskStateEnum.PENDING:
+            self._notify(TASK_CHANNEL, pipeline_name)
+        await self._commit()
+
+        return TaskUpdateResult(
+            task_input_id=task_input_id, status=new_status, updated=True
+        )
+
+    async def update_tasks(
+        self, token_id: int, pipeline_name: str, tasks: list[Task]
+    ) -> list[TaskUpdateResult]:
+        """
+        Given tasks of a pipeline with their new status and, optionally,
+        priority updates the tasks in one transaction.
+
+        Tasks are identified by their task input or, if it is not given, by
+        their task input ID. Tasks with the same change are updated by one
+        UPDATE ... RETURNING statement, the events for the updated tasks are
+        inserted in bulk. The state transitions are checked as in update_task.
+
+        Returns a result for each of the given tasks, in the same order. Tasks
+        that do not exist or are in a state that does not allow the change
+        are reported as not updated. If the same task is given more than
+        once, only the last change is applied.
+        """
+        (pipeline_id, _) = await self._get_pipeline(pipeline_name)
+
+        task_ids = [
+            generate_task_input_id(task.task_input)
+            if task.task_input is not None
+            else task.task_input_id
+            for task in tasks
+        ]
+        last_changes = {
+            task_id: (task.status, task.priority)
+            for (task_id, task) in zip(task_ids, tasks)
+        }
+        changes = {}
+        for task_id, change in last_changes.items():
+            changes.setdefault(change, []).append(task_id)
+
+        updated_ids = set()
+        for (new_status, priority), change_task_ids in changes.items():
+            values = {"state": new_status, "updated": func.now()}
+            if priority is not None:
+                values["priority"] = priority
+            if new_status not in LEASED_STATES:
+                values["lease_expires"] = None
+            for chunk in _chunks(change_task_ids):
+                changed = await self._transition(
+                    [
+                        DbTask.pipeline_id == pipeline_id,
+                        DbTask.job_descriptor.in_(chunk),
+                        self._transition_condition(new_status),
+                    ],
+                    values,
+                    DbTask.task_id,
+                    DbTask.job_descriptor,
+                    DbTask.created,
+                    DbTask.updated,
+                    synchronize_session=False,
+                )
+                updated_ids.update(row.job_descriptor for (row, _) in changed)
+                await self._log_events(
+                    token_id,
+                    [row.task_id for (row, _) in changed],
+                    f"Task changed, new status {new_status}",
+                )
+                for old_state, n in Counter(state for (_, state) in changed).items():
+                    self._count_transition(pipeline_id, old_state, new_status, n)
+                for row, old_state in changed:
+                    self._record_duration(
+                        pipeline_id,
+                        old_state,
+                        new_status,
+                        row.created,
+                        row.updated,
+                    )
+            if new_status == TaskStateEnum.PENDING:
+                self._notify(TASK_CHANNEL, pipeline_name)
+        await self._commit()
+
+        # Tasks that were not updated either do not exist or are in a state
+        # that does not allow the change.
+        current_states = {}
+        for chunk in _chunks([i for i in last_changes if i not in updated_ids]):
+            result = await self.session.execute(
+                select(DbTask.job_descriptor, DbTask.state)
+                .where(DbTask.pipeline_id == pipeline_id)
+                .where(DbTask.job_descriptor.in_(chunk))
+            )
+            current_states.update((row.job_descriptor, row.state) for row in result)
 
-        return og_task.convert_to_model()
+        last_index = {task_id: i for (i, task_id) in enumerate(task_ids)}
+        results = []
+        for i, (task_id, task) in enumerate(zip(task_ids, tasks)):
+            detail = None
+            if last_index[task_id] != i:
+                detail = "Superseded by a later change of the same task"
+            elif task_id in current_states:
+                detail = _transition_failure(current_states[task_id], task.status)
+            elif task_id not in updated_ids:
+                detail = "Task to be modified could not be found"
+            results.append(
+                TaskUpdateResult(
+                    task_input_id=task_id,
+                    status=task.status,
+                    updated=detail is None,
+                    detail=detail,
+                )
+            )
+        return results
+
+    async def extend_lease(
+        self, pipeline_name: str, task_input_id: str, lease: int
+    ) -> TaskLease:
+        """
+        Sets the lease of a CLAIMED or RUNNING task to expire in the given
+        number of seconds from now. No event is recorded.
+
+        Raises NoResultFound if the pipeline has no such task in either of
+        these states.
+        """
+        lease_expires = datetime.now() + timedelta(seconds=lease)
+        pipeline_id = (
+            select(DbPipeline.pipeline_id)
+            .where(DbPipeline.name == pipeline_name)
+            .scalar_subquery()
+        )
+        result = await self.session.execute(
+            update(DbTask)
+            .where(DbTask.pipeline_id == pipeline_id)
+            .where(DbTask.job_descriptor == task_input_id)
+            .where(DbTask.state.in_([_state_literal(s) for s in LEASED_STATES]))
+            .values(lease_expires=lease_expires)
+            .returning(DbTask.job_descriptor, DbTask.lease_expires)
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            row = result.one()
+        except NoResultFound:
+            raise NoResultFound("No claimed or running task to extend the lease of")
+        await self._commit()
+
+        return TaskLease(
+            task_input_id=row.job_descriptor, lease_expires=row.lease_expires
+        )
+
+    async def reap_expired_leases(self, now: datetime | None = None) -> int:
+        """
+        Returns CLAIMED and RUNNING tasks with expired leases to the PENDING
+        state, so that they can be claimed again. An event is recorded for
+        each task under the token which was the last one to change the task.
+
+        Returns the number of tasks returned to the PENDING state.
+        """
+        session = self.session
+        if now is None:
+            now = datetime.now()
+
+        changed = await self._transition(
+            [
+                DbTask.lease_expires < now,
+                DbTask.state.in_([_state_literal(s) for s in LEASED_STATES]),
+            ],
+            {
+                "state": TaskStateEnum.PENDING,
+                "lease_expires": None,
+                "updated": func.now(),
+            },
+            DbTask.task_id,
+            DbTask.pipeline_id,
+            synchronize_session=False,
+        )
+        if not changed:
+            return 0
+        for (pipeline_id, old_state), n in Counter(
+            (row.pipeline_id, old_state) for (row, old_state) in changed
+        ).items():
+            self._count_transition(pipeline_id, old_state, TaskStateEnum.PENDING, n)
+
+        reaped = [row for (row, _) in changed]
+        task_ids = [row.task_id for row in reaped]
+        last_token_id = (
+            select(Event.token_id)
+            .where(Event.task_id == DbTask.task_id)
+            .order_by(Event.time.desc(), Event.event_id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        await session.execute(
+            insert(Event).from_select(
+                ["task_id", "token_id", "change"],
+                select(
+                    DbTask.task_id,
+                    last_token_id,
+                    literal(f"Task lease expired, new status {TaskStateEnum.PENDING}"),
+                ).where(DbTask.task_id.in_(task_ids)),
+            )
+        )
+        pipeline_names = await session.execute(
+            select(DbPipeline.name).where(
+                DbPipeline.pipeline_id.in_({row.pipeline_id for row in reaped})
+            )
+        )
+        for name in pipeline_names.scalars():
+            self._notify(TASK_CHANNEL, name)
+        await self._commit()
+
+        self.logger.info(f"Returned {len(task_ids)} tasks with expired leases")
+        return len(task_ids)
 
     async def get_tasks(
-        self, pipeline_name: str | None = None, task_status: TaskStateEnum | None = None
-    ) -> list[Task]:
+        self,
+        pipeline_name: str | None = None,
+        task_status: TaskStateEnum | None = None,
+        fields: list[str] | None = None,
+    ) -> list[Task] | list[dict]:
         """
         Gets all the tasks.
 
         Can filter tasks by pipeline name and task status in order to be more useful.
+
+        If fields of the Task model are given, only the columns of these
+        fields are selected and dictionaries with just these fields are
+        returned instead of Task objects.
         """
-        query = (
-            select(DbTask).join(DbTask.pipeline).options(joinedload(DbTask.pipeline))
-        )
+        query = await self._tasks_query(pipeline_name, task_status, fields)
+        if query is None:
+            return []
+        task_result = await self.session.execute(query)
+        if fields:
+            return [_task_fields(row, fields) for row in task_result]
+        return _convert_tasks(task_result.scalars())
 
+    async def get_task_page(
+        self,
+        pipeline_name: str | None = None,
+        task_status: TaskStateEnum | None = None,
+        limit: int | None = None,
+        after: int | None = None,
+        fields: list[str] | None = None,
+    ) -> tuple[list[Task] | list[dict], int | None]:
+        """
+        Gets a page of tasks in (created, task_id) order, filtered and
+        projected as in get_tasks.
+
+        The page starts after the task with the given task_id and has at most
+        the given number of tasks. The (created, task_id) key of that task is
+        looked up by the database, which then reads the page with an index
+        range scan. The cost of a page does not depend on the number of tasks
+        before it.
+
+        Returns the tasks and, if there are more tasks, the task_id of the
+        last task, otherwise None.
+        """
+        query = await self._tasks_query(pipeline_name, task_status, fields)
+        if query is None:
+            return ([], None)
+        query = query.order_by(DbTask.created, DbTask.task_id)
+        if after is not None:
+            last_task = aliased(DbTask)
+            last_key = (
+                select(last_task.created, last_task.task_id)
+                .where(last_task.task_id == after)
+                .scalar_subquery()
+            )
+            query = query.where(tuple_(DbTask.created, DbTask.task_id) > last_key)
+        if limit is not None:
+            query = query.limit(limit + 1)
+
+        task_result = await self.session.execute(query)
+        tasks = task_result.all() if fields else task_result.scalars().all()
+        next_after = None
+        if limit is not None and len(tasks) > limit:
+            tasks = tasks[:limit]
+            next_after = tasks[-1].task_id
+        if fields:
+            return ([_task_fields(row, fields) for row in tasks], next_after)
+        return (_convert_tasks(tasks), next_after)
+
+    async def stream_tasks(
+        self,
+        pipeline_name: str | None = None,
+        task_status: TaskStateEnum | None = None,
+        fields: list[str] | None = None,
+    ) -> AsyncIterator[list[Task] | list[dict]]:
+        """
+        Gets the same tasks as get_tasks, but yields them in batches as they
+        are fetched from a server-side cursor. Only one batch of tasks is
+        held in memory at a time.
+        """
+        query = await self._tasks_query(pipeline_name, task_status, fields)
+        if query is None:
+            return
+        query = query.execution_options(yield_per=STREAM_BATCH_SIZE)
+        task_result = await self.session.stream(query)
+        if fields:
+            async for rows in task_result.partitions():
+                yield [_task_fields(row, fields) for row in rows]
+        else:
+            async for db_tasks in task_result.scalars().partitions():
+                yield _convert_tasks(db_tasks)
+
+    async def _tasks_query(
+        self,
+        pipeline_name: str | None = None,
+        task_status: TaskStateEnum | None = None,
+        fields: list[str] | None = None,
+    ):
+        """
+        Returns the unordered query for tasks, or None if there is no pipeline
+        with the given name.
+
+        The tasks of a pipeline are selected by the ID of the pipeline, which
+        is looked up in the pipeline cache, so that they can be read in
+        (created, task_id) order from idx_paged_tasks.
+        """
+        pipeline_id = None
         if pipeline_name:
-            query = query.where(DbPipeline.name == pipeline_name)
+            try:
+                (pipeline_id, _) = await self._get_pipeline(pipeline_name)
+            except NoResultFound:
+                return None
+        if fields:
+            query = (
+                select(*_task_field_columns(fields))
+                .select_from(DbTask)
+                .join(DbTask.pipeline)
+            )
+        else:
+            query = (
+                select(DbTask)
+                .join(DbTask.pipeline)
+                .options(contains_eager(DbTask.pipeline))
+            )
+
+        if pipeline_id is not None:
+            query = query.where(DbTask.pipeline_id == pipeline_id)
 
         if task_status:
             query = query.filter(DbTask.state == task_status)
 
-        task_result = await self.session.execute(query)
-        tasks = task_result.scalars().all()
-        return [t.convert_to_model() for t in tasks]
+        return query
 
     async def get_expanded_tasks(
         self,
         pipeline_name: str = None,
         status: list[TaskStateEnum] = None,
         since: datetime = None,
-    ) -> list[TaskExpanded]:
+        fields: list[str] | None = None,
+    ) -> list[TaskExpanded] | list[dict]:
         """
         Gets information about tasks including their creation date, ordered
         by their most recent status update.
 
-        Can be filtered by pipeline name and status.
+        Can be filtered by pipeline name and status. Can be projected to the
+        given fields of the TaskExpanded model as in get_tasks.
         """
-        latest_event = (
-            select(samax(Event.time).label("status_date"), Event.task_id)
-            .select_from(Event)
-            .group_by(Event.task_id)
-            .subquery()
-        )
+        query = self._expanded_tasks_query(
+            pipeline_name, status, since, fields
+        ).order_by(DbTask.updated.desc())
+
+        self.logger.debug(query.compile())
+        task_result = await self.session.execute(query)
+        return self._convert_expanded_tasks(task_result, fields)
+
+    async def get_expanded_task_page(
+        self,
+        pipeline_name: str = None,
+        status: list[TaskStateEnum] = None,
+        since: datetime = None,
+        start: int = 0,
+        length: int | None = None,
+        order: list[tuple[str, bool]] | None = None,
+        search: str | None = None,
+        fields: list[str] | None = None,
+    ) -> tuple[list[TaskExpanded] | list[dict], int, int]:
+        """
+        Gets a page of the tasks of get_expanded_tasks, for a table that is
+        paged, ordered and searched by the server.
+
+        The tasks are filtered as in get_expanded_tasks, then searched for
+        the given text in the pipeline name and version, the status and the
+        task input. The matching tasks are ordered by the given (field,
+        descending) pairs, fields can be pipeline.name, pipeline.version,
+        task_input_id, status, priority, created and updated. Finally the page
+        of at most the given length is cut from the given start.
+
+        Returns the tasks of the page, the number of tasks matching the
+        filters and the number of tasks that also match the search text.
+        Unless tasks are filtered by time, the number of tasks matching the
+        filters is read from the task counters.
+        """
+        query = self._expanded_tasks_query(pipeline_name, status, since, fields)
+        if since is None:
+            total = await self.count_tasks(pipeline_name, status)
+        else:
+            total = await self._count_rows(query)
+        filtered = total
+        if search:
+            query = query.where(
+                or_(
+                    DbPipeline.name.icontains(search, autoescape=True),
+                    DbPipeline.version.icontains(search, autoescape=True),
+                    DbTask.state.icontains(search, autoescape=True),
+                    cast(DbTask.definition, String).icontains(search, autoescape=True),
+                )
+            )
+            filtered = await self._count_rows(query)
+
+        order_columns = _EXPANDED_TASK_ORDER_COLUMNS
+        order_by = [
+            order_columns[field].desc() if descending else order_columns[field].asc()
+            for (field, descending) in (order or [])
+            if field in order_columns
+        ]
         query = (
-            select(DbTask, latest_event.c.status_date)
-            .select_from(DbTask)
-            .join(latest_event, DbTask.task_id == latest_event.c.task_id)
-            .join(DbTask.pipeline)
-            .options(contains_eager(DbTask.pipeline))
-            .order_by(latest_event.c.status_date.desc())
+            query.order_by(*order_by, DbTask.updated.desc(), DbTask.task_id)
+            .offset(start)
+            .limit(length)
         )
 
+        task_result = await self.session.execute(query)
+        return (self._convert_expanded_tasks(task_result, fields), total, filtered)
+
+    @staticmethod
+    def _expanded_tasks_query(
+        pipeline_name: str = None,
+        status: list[TaskStateEnum] = None,
+        since: datetime = None,
+        fields: list[str] | None = None,
+    ):
+        "Returns the unordered query for expanded tasks"
+        if fields:
+            query = select(*_task_field_columns(fields)).select_from(DbTask)
+        else:
+            query = select(DbTask).options(contains_eager(DbTask.pipeline))
+        query = query.join(DbTask.pipeline)
+
         if pipeline_name:
             query = query.where(DbPipeline.name == pipeline_name)
         if status:
             query = query.where(or_(DbTask.state == state for state in status))
         if since:
-            query = query.where(latest_event.c.status_date >= since)
+            query = query.where(DbTask.updated >= since)
 
-        self.logger.debug(query.compile())
-        task_result = await self.session.execute(query)
-        return [
-            t.Task.convert_to_model(TaskExpanded, t.status_date) for t in task_result
-        ]
+        return query
 
-    async def count_tasks(self) -> int:
-        query = select(count()).select_from(DbTask)
+    @staticmethod
+    def _convert_expanded_tasks(
+        task_result, fields: list[str] | None = None
+    ) -> list[TaskExpanded] | list[dict]:
+        if fields:
+            return [_task_fields(row, fields) for row in task_result]
+        return _convert_tasks(task_result.scalars(), TaskExpanded)
+
+    async def _count_rows(self, query) -> int:
+        "Counts the rows of an unordered query"
+        count_query = select(count()).select_from(
+            query.with_only_columns(DbTask.task_id).subquery()
+        )
+        return (await self.session.execute(count_query)).scalar_one()
+
+    async def count_tasks(
+        self, pipeline_name: str = None, status: list[TaskStateEnum] = None
+    ) -> int:
+        """
+        Returns the number of tasks, optionally of a pipeline and in the given
+        states, from the task counters.
+        """
+        query = select(func.coalesce(func.sum(TaskCount.n), 0))
+        if pipeline_name:
+            query = query.join(DbPipeline).where(DbPipeline.name == pipeline_name)
+        if status:
+            query = query.where(TaskCount.state.in_(status))
         count_result = await self.session.execute(query)
-        return count_result.scalar()
+        return count_result.scalar_one()
+
+    async def get_pipeline_stats(self, pipeline_name: str) -> PipelineStats:
+        """
+        Returns the number of tasks of the pipeline in each state, read from
+        the task counters.
+
+        Raises NoResultFound if the pipeline does not exist.
+        """
+        (pipeline_id, _) = await self._get_pipeline(pipeline_name)
+        result = await self.session.execute(
+            select(TaskCount.state, TaskCount.n).where(
+                TaskCount.pipeline_id == pipeline_id
+            )
+        )
+        counts = {state: 0 for state in TaskStateEnum}
+        counts.update((TaskStateEnum(row.state), row.n) for row in result)
+
+        durations = await self.session.get(TaskDuration, pipeline_id)
+        summary = DurationSummary()
+        if durations is not None:
+            summary = DurationSummary(durations.n, durations.mean, durations.m2)
+        result = await self.session.execute(
+            select(TaskDurationBucket.bucket, TaskDurationBucket.n).where(
+                TaskDurationBucket.pipeline_id == pipeline_id
+            )
+        )
+        buckets = dict(
+            (row.bucket, row.n) for row in result if row.bucket < len(DURATION_BUCKETS)
+        )
+        variance = summary.variance()
+        return PipelineStats(
+            pipeline=pipeline_name,
+            counts=counts,
+            total=sum(counts.values()),
+            durations=TaskDurationStats(
+                count=summary.n,
+                mean=summary.mean if summary.n else None,
+                stdev=None if variance is None else max(variance, 0) ** 0.5,
+                histogram={
+                    label: buckets.get(i, 0)
+                    for (i, (label, _)) in enumerate(DURATION_BUCKETS)
+                },
+            ),
+        )
 
     async def get_long_running_tasks(self) -> list[TaskExpanded]:
         """
         Returns tasks have been NOT DONE for longer than is expected, taking
         2 standard deviations more than the mean time for DONE tasks in their
         pipeline.
+
+        The mean and the variance of the durations of DONE tasks are read from
+        the duration statistics of the pipelines, only the long running tasks
+        are retrieved. Pipelines with fewer than two DONE tasks have no long
+        running tasks.
         """
-        tasks = await self.get_expanded_tasks()
-        lengths = {}
-        not_done = {}
-        for task in tasks:
-            if task.status == TaskStateEnum.DONE:
-                lengths.setdefault(task.pipeline.name, []).append(
-                    (task.updated - task.created).total_seconds()
-                )
-            elif task.status != TaskStateEnum.CANCELLED:
-                not_done.setdefault(task.pipeline.name, []).append(task)
-        long_running = []
-        for pipeline, pipeline_tasks in not_done.items():
-            if pipeline not in lengths.keys() or len(lengths[pipeline]) < 2:
-                continue  # not enough data for this pipeline
-            cutoff = mean(lengths[pipeline]) + (2 * stdev(lengths[pipeline]))
-            for task in pipeline_tasks:
-                if (datetime.now() - task.created).total_seconds() > cutoff:
-                    long_running.append(task)
-        return long_running
+        variance = TaskDuration.m2 / func.nullif(TaskDuration.n - 1, 0)
+        # Compared without square roots, which SQLite might not have.
+        excess = (
+            self._seconds_between(DbTask.created, literal(datetime.now(), DateTime))
+            - TaskDuration.mean
+        )
+        query = (
+            select(DbTask)
+            .options(contains_eager(DbTask.pipeline))
+            .join(DbTask.pipeline)
+            .join(TaskDuration, TaskDuration.pipeline_id == DbTask.pipeline_id)
+            .where(TaskDuration.n >= 2)
+            .where(DbTask.state.not_in([TaskStateEnum.DONE, TaskStateEnum.CANCELLED]))
+            .where(excess > 0)
+            .where(excess * excess > LONG_RUNNING_STDEVS**2 * variance)
+            .order_by(DbTask.updated.desc())
+        )
+        task_result = await self.session.execute(query)
+        return self._convert_expanded_tasks(task_result)
+
+    def _seconds_between(self, start, end):
+        "Returns an SQL expression for the number of seconds from start to end"
+        if self.session.bind.dialect.name == "postgresql":
+            return func.extract("epoch", end - start)
+        return (func.julianday(end) - func.julianday(start)) * 86400
 
     async def get_db_task(
         self,
@@ -337,14 +1517,15 @@ class AsyncDbAccessor:
         return task_result.scalars().one()
 
     @staticmethod
-    def convert_task_to_db(task: Task, pipeline: DbPipeline) -> DbTask:
+    def convert_task_to_db(task: Task, pipeline_id: int) -> DbTask:
         assert task.status in TaskStateEnum
 
         return DbTask(
-            pipeline=pipeline,
+            pipeline_id=pipeline_id,
             job_descriptor=task.generate_task_id(),
             definition=task.task_input,
             state=task.status,
+            priority=task.priority or 0,
         )
 
     async def get_events_for_task(self, task: Task) -> list[Event]:
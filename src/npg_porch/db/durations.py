@@ -0,0 +1,80 @@
+# Copyright (C) 2026 Genome Research Ltd.
+#
+# This file is part of npg_porch
+#
+# npg_porch is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Summaries of the durations of DONE tasks, in seconds from the creation of
+a task to its completion.
+
+The summaries of batches of durations are merged into the running
+statistics of a pipeline, so the statistics never have to be computed
+from all tasks again.
+"""
+
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass
+
+# Histogram buckets as (label, inclusive upper bound in seconds). The last
+# bucket has no upper bound.
+DURATION_BUCKETS = (
+    ("1m", 60),
+    ("10m", 600),
+    ("1h", 3600),
+    ("6h", 6 * 3600),
+    ("1d", 24 * 3600),
+    ("7d", 7 * 24 * 3600),
+    ("longer", None),
+)
+
+_UPPER_BOUNDS = [bound for (_, bound) in DURATION_BUCKETS[:-1]]
+
+
+@dataclass
+class DurationSummary:
+    "The number, mean and M2 of Welford's algorithm of some durations"
+
+    n: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+
+    def add(self, duration: float):
+        "Adds one duration using Welford's algorithm"
+        self.n += 1
+        delta = duration - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (duration - self.mean)
+
+    def variance(self) -> float | None:
+        "Returns the sample variance, None for fewer than two durations"
+        if self.n < 2:
+            return None
+        return self.m2 / (self.n - 1)
+
+
+def duration_bucket(duration: float) -> int:
+    "Returns the index of the histogram bucket of the duration"
+    return bisect_left(_UPPER_BOUNDS, duration)
+
+
+def summarise_durations(durations) -> tuple[DurationSummary, Counter]:
+    "Returns the summary and the histogram bucket counts of the durations"
+    summary = DurationSummary()
+    buckets = Counter()
+    for duration in durations:
+        summary.add(duration)
+        buckets[duration_bucket(duration)] += 1
+    return (summary, buckets)
@@ -0,0 +1,242 @@
+# Copyright (C) 2026 Genome Research Ltd.
+#
+# This file is part of npg_porch
+#
+# npg_porch is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Maintenance of the schema, of denormalised task columns and of the task
+counters and duration statistics on existing databases.
+
+The functions use a synchronous engine or session, they are run by the
+scripts in the scripts directory rather than by the server.
+"""
+
+import logging
+
+from sqlalchemy import Engine, delete, insert, inspect, select, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from sqlalchemy.sql.functions import coalesce, count, max as samax
+
+from npg_porch.db.durations import summarise_durations
+from npg_porch.db.models import (
+    Base,
+    Event,
+    Task,
+    TaskCount,
+    TaskDuration,
+    TaskDurationBucket,
+)
+from npg_porch.models import TaskStateEnum
+
+BACKFILL_BATCH_SIZE = 10000
+
+# Indexes of earlier schemas that have been replaced, by table.
+OBSOLETE_INDEXES = {
+    # Superseded by idx_paged_tasks on (pipeline_id, created, task_id).
+    "task": ["idx_ordered_tasks"],
+}
+
+# Indexes of the current schema that are left invalid by a failed
+# CREATE INDEX CONCURRENTLY.
+_INVALID_INDEXES_QUERY = text(
+    """
+    SELECT c.relname FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE NOT i.indisvalid AND n.nspname = current_schema()
+    """
+)
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_schema(engine: Engine) -> list[str]:
+    """Brings an existing schema up to date with the ORM.
+
+    Missing tables are created. Missing columns are added, columns that are
+    not nullable have to have a server default. Missing indexes are built,
+    on PostgreSQL with CREATE INDEX CONCURRENTLY, so that tasks can be
+    created and updated while the indexes are built. Indexes left invalid
+    by an interrupted build are dropped and built again. Obsolete indexes
+    are dropped once their replacements exist, concurrently on PostgreSQL.
+
+    Every statement is committed on its own, the upgrade can be stopped
+    and run again.
+
+    Returns the statements that were run, except for the creation of
+    tables.
+    """
+    Base.metadata.create_all(engine)
+
+    statements = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        postgresql = conn.dialect.name == "postgresql"
+        preparer = conn.dialect.identifier_preparer
+        inspector = inspect(conn)
+
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    statements.append(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                        + str(CreateColumn(column).compile(dialect=conn.dialect))
+                    )
+
+        invalid = set()
+        if postgresql:
+            invalid = set(conn.execute(_INVALID_INDEXES_QUERY).scalars())
+        for table in Base.metadata.sorted_tables:
+            existing = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name in invalid:
+                    statements.append(
+                        f"DROP INDEX CONCURRENTLY {preparer.format_index(index)}"
+                    )
+                elif index.name in existing:
+                    continue
+                statements.append(_create_index(index, conn.dialect, postgresql))
+
+        concurrently = " CONCURRENTLY" if postgresql else ""
+        for table_name, index_names in OBSOLETE_INDEXES.items():
+            existing = {i["name"] for i in inspector.get_indexes(table_name)}
+            for name in index_names:
+                if name in existing:
+                    statements.append(
+                        f"DROP INDEX{concurrently} {preparer.quote(name)}"
+                    )
+
+        for statement in statements:
+            logger.info(statement)
+            conn.exec_driver_sql(statement)
+
+    return statements
+
+
+def _create_index(index, dialect, concurrently: bool) -> str:
+    options = index.dialect_options["postgresql"]
+    default = options["concurrently"]
+    options["concurrently"] = concurrently
+    try:
+        return str(CreateIndex(index).compile(dialect=dialect))
+    finally:
+        options["concurrently"] = default
+
+
+def backfill_task_updated(
+    session: Session, batch_size: int = BACKFILL_BATCH_SIZE
+) -> int:
+    """Sets the last update time of tasks that do not have one yet.
+
+    The time is the time of the latest event of the task, or the creation
+    time if the task has no events. Tasks are updated in batches, each batch
+    is committed, so the backfill can be stopped and resumed.
+
+    Returns the number of updated tasks.
+    """
+    latest_event_time = (
+        select(samax(Event.time))
+        .where(Event.task_id == Task.task_id)
+        .scalar_subquery()
+    )
+    total = 0
+    while True:
+        batch = (
+            select(Task.task_id)
+            .where(Task.updated.is_(None))
+            .order_by(Task.task_id)
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        result = session.execute(
+            update(Task)
+            .where(Task.task_id.in_(batch))
+            .values(updated=coalesce(latest_event_time, Task.created))
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        if result.rowcount == 0:
+            return total
+        total += result.rowcount
+
+
+def rebuild_task_counts(session: Session):
+    """Recounts the tasks of each pipeline in each state.
+
+    On PostgreSQL the task table is locked against changes, but not reads,
+    while the tasks are counted, so that the counters are exact once the
+    transaction is committed.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("LOCK TABLE task IN SHARE MODE"))
+    session.execute(delete(TaskCount))
+    session.execute(
+        insert(TaskCount).from_select(
+            ["pipeline_id", "state", "n"],
+            select(Task.pipeline_id, Task.state, count()).group_by(
+                Task.pipeline_id, Task.state
+            ),
+        )
+    )
+    session.commit()
+
+
+def rebuild_task_durations(session: Session):
+    """Recomputes the duration statistics of each pipeline from events.
+
+    The duration of a DONE task is the time from its creation to its latest
+    event. The durations are read from the database one pipeline at a time
+    and summarised as they arrive.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("LOCK TABLE task IN SHARE MODE"))
+    session.execute(delete(TaskDurationBucket))
+    session.execute(delete(TaskDuration))
+    latest_event_time = (
+        select(samax(Event.time))
+        .where(Event.task_id == Task.task_id)
+        .scalar_subquery()
+    )
+    pipeline_ids = session.scalars(
+        select(Task.pipeline_id)
+        .where(Task.state == TaskStateEnum.DONE)
+        .group_by(Task.pipeline_id)
+        .order_by(Task.pipeline_id)
+    ).all()
+    for pipeline_id in pipeline_ids:
+        rows = session.execute(
+            select(Task.created, latest_event_time.label("done"))
+            .where(Task.pipeline_id == pipeline_id)
+            .where(Task.state == TaskStateEnum.DONE)
+            .execution_options(yield_per=BACKFILL_BATCH_SIZE)
+        )
+        (summary, buckets) = summarise_durations(
+            (row.done - row.created).total_seconds()
+            for row in rows
+            if row.done is not None
+        )
+        if summary.n == 0:
+            continue
+        session.add(
+            TaskDuration(
+                pipeline_id=pipeline_id, n=summary.n, mean=summary.mean, m2=summary.m2
+            )
+        )
+        session.add_all(
+            TaskDurationBucket(pipeline_id=pipeline_id, bucket=bucket, n=n)
+            for (bucket, n) in buckets.items()
+        )
+    session.commit()
@@ -3,3 +3,5 @@ from .token import Token
 from .pipeline import Pipeline
 from .task import Task
 from .event import Event
+from .task_count import TaskCount
+from .task_duration import TaskDuration, TaskDurationBucket
@@ -19,7 +19,7 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 
 import sqlalchemy
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from .base import Base
@@ -38,6 +38,9 @@ class Event(Base):
     change = Column(String)
     token_id = Column(Integer, ForeignKey("token.token_id"), nullable=False)
 
+    # Events of a task in order, and the latest event of a task.
+    Index("idx_task_events", task_id, time, event_id)
+
     task = relationship("Task")
 
     # Consider adding 'order_by=Token.token_id'
@@ -42,7 +42,7 @@ class Pipeline(Base):
     tokens = relationship("Token", back_populates="pipeline")
 
     def convert_to_model(self):
-        "Convert sqlalchemy object to npg_porch format"
-        return ModeledPipeline(
+        "Convert sqlalchemy object to npg_porch format, values are not validated"
+        return ModeledPipeline.model_construct(
             name=self.name, version=self.version, uri=self.repository_uri
         )
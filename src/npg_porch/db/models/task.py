@@ -33,7 +33,9 @@ from sqlalchemy.sql.functions import now
 from sqlalchemy.sql.sqltypes import DateTime
 
 from .base import Base
+from npg_porch.models import Pipeline as ModelledPipeline
 from npg_porch.models import Task as ModelledTask, TaskExpanded as ModelledTaskExpanded
+from npg_porch.models import TaskStateEnum
 
 
 class Task(Base):
@@ -56,6 +58,14 @@ class Task(Base):
     # or LSF job names and so on.
     prefix = Column(String)
     created = Column(DateTime, default=now())
+    # The time of the last change of state, the same as the time of the
+    # latest event of the task. Set by every statement that changes state.
+    updated = Column(DateTime, default=now())
+    # Pending tasks with higher priority are claimed first.
+    priority = Column(Integer, nullable=False, default=0, server_default="0")
+    # A claimed or running task is returned to the pending state once
+    # its lease has expired, unless the lease is extended.
+    lease_expires = Column(DateTime, nullable=True)
 
     # Set unique this way so that SQLite creates the constraint
     __table_args__ = (
@@ -63,7 +73,34 @@ class Task(Base):
     )
 
     # Index('idx_unique_tasks', pipeline_id, job_descriptor, unique=True)
-    Index("idx_ordered_tasks", pipeline_id, created)
+    # Pages of task listings are read in (created, task_id) order, starting
+    # after the last task of the previous page. Replaces idx_ordered_tasks
+    # on (pipeline_id, created).
+    Index("idx_paged_tasks", pipeline_id, created, task_id)
+    Index("idx_paged_all_tasks", created, task_id)
+    Index("idx_updated_tasks", updated)
+    # Listings of tasks in a given state, by pipeline in page order and
+    # across pipelines by the time of the last change.
+    Index("idx_paged_state_tasks", pipeline_id, state, created, task_id)
+    Index("idx_state_updated_tasks", state, updated)
+    # Only claimed and running tasks have a lease, the reaper scans these.
+    Index(
+        "idx_leased_tasks",
+        lease_expires,
+        postgresql_where=(lease_expires.is_not(None)),
+        sqlite_where=(lease_expires.is_not(None)),
+    )
+    # Pending tasks of a pipeline in the order they are claimed. Claimed
+    # and finished tasks, which are the bulk of the table, are not indexed.
+    Index(
+        "idx_claimable_tasks",
+        pipeline_id,
+        priority.desc(),
+        created,
+        task_id,
+        postgresql_where=(state == TaskStateEnum.PENDING.value),
+        sqlite_where=(state == TaskStateEnum.PENDING.value),
+    )
 
     pipeline = relationship("Pipeline", back_populates="tasks")
     events = relationship("Event", back_populates="task")
@@ -72,14 +109,24 @@ class Task(Base):
         self,
         task_class: type[ModelledTask | ModelledTaskExpanded] = ModelledTask,
         updated: datetime = None,
+        pipeline: ModelledPipeline | None = None,
     ) -> ModelledTask | ModelledTaskExpanded:
+        """
+        Convert to npg_porch format, with the given pipeline model if any
+
+        The values come from the database and are not validated again. Tasks
+        of the same pipeline can share one pipeline model.
+        """
+        if pipeline is None:
+            pipeline = self.pipeline.convert_to_model()
         init_args = {
-            "pipeline": self.pipeline.convert_to_model(),
+            "pipeline": pipeline,
             "task_input_id": self.job_descriptor,
             "task_input": self.definition,
-            "status": self.state,
+            "status": TaskStateEnum(self.state),
+            "priority": self.priority,
         }
         if task_class == ModelledTaskExpanded:
             init_args["created"] = self.created
-            init_args["updated"] = updated
-        return task_class(**init_args)
+            init_args["updated"] = updated if updated is not None else self.updated
+        return task_class.model_construct(**init_args)
@@ -0,0 +1,35 @@
+# Copyright (C) 2026 Genome Research Ltd.
+#
+# This file is part of npg_porch
+#
+# npg_porch is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import Column, ForeignKey, Integer, String
+
+from .base import Base
+
+
+class TaskCount(Base):
+    """
+    The number of tasks of a pipeline in a state. Kept up to date within
+    the transactions that create tasks or change their state, so that
+    tasks need not be counted.
+    """
+
+    __tablename__ = "task_count"
+    pipeline_id = Column(
+        Integer, ForeignKey("pipeline.pipeline_id"), primary_key=True
+    )
+    state = Column(String, primary_key=True)
+    n = Column(Integer, nullable=False, default=0, server_default="0")
@@ -0,0 +1,51 @@
+# Copyright (C) 2026 Genome Research Ltd.
+#
+# This file is part of npg_porch
+#
+# npg_porch is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import Column, Float, ForeignKey, Integer
+
+from .base import Base
+
+
+class TaskDuration(Base):
+    """
+    Running statistics of the time from creation to completion of the DONE
+    tasks of a pipeline: the number of tasks, the mean duration in seconds
+    and the sum of the squared differences from the mean (M2 of Welford's
+    algorithm). Updated when tasks become DONE.
+    """
+
+    __tablename__ = "task_duration"
+    pipeline_id = Column(
+        Integer, ForeignKey("pipeline.pipeline_id"), primary_key=True
+    )
+    n = Column(Integer, nullable=False, default=0, server_default="0")
+    mean = Column(Float, nullable=False, default=0, server_default="0")
+    m2 = Column(Float, nullable=False, default=0, server_default="0")
+
+
+class TaskDurationBucket(Base):
+    """
+    The number of DONE tasks of a pipeline with a duration in one of the
+    buckets of a histogram, see npg_porch.db.durations.
+    """
+
+    __tablename__ = "task_duration_bucket"
+    pipeline_id = Column(
+        Integer, ForeignKey("pipeline.pipeline_id"), primary_key=True
+    )
+    bucket = Column(Integer, primary_key=True)
+    n = Column(Integer, nullable=False, default=0, server_default="0")
@@ -0,0 +1,142 @@
+# Copyright (C) 2026 Genome Research Ltd.
+#
+# This file is part of npg_porch
+#
+# npg_porch is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Notifications about committed database changes.
+
+On PostgreSQL the notifications are sent with NOTIFY within the transaction
+that makes the change, they are delivered to all server processes when the
+transaction is committed. Each process LISTENs on a dedicated connection and
+passes the notifications on to its Notifier.
+
+Other databases are only ever used by a single server process. The
+notifications are passed to the Notifier of this process directly after
+the transaction is committed.
+"""
+
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+# A new task can be claimed, the payload is the pipeline name.
+TASK_CHANNEL = "npg_porch_task"
+# A token has been revoked, the payload is the token ID.
+TOKEN_CHANNEL = "npg_porch_token"
+# A pipeline has been created or changed, the payload is the pipeline name.
+PIPELINE_CHANNEL = "npg_porch_pipeline"
+
+LISTENER_RECONNECT_DELAY = 5
+
+
+class Notifier:
+    """
+    Wakes up coroutines waiting for a notification and calls the subscribers
+    of its channel.
+
+    Notifications are identified by a channel and a payload. The coroutines
+    might run in event loops of different threads, so notify() can be called
+    from any thread.
+    """
+
+    def __init__(self):
+        self._waiters: dict[tuple[str, str], set[asyncio.Future]] = {}
+        self._subscribers: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def notify(self, channel: str, payload: str):
+        with self._lock:
+            waiters = self._waiters.pop((channel, payload), set())
+            subscribers = list(self._subscribers.get(channel, []))
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(_wake, future)
+        for callback in subscribers:
+            callback(payload)
+
+    def subscribe(self, channel: str, callback):
+        """
+        Calls the callback with the payload of every notification on the
+        channel, in the thread that sends the notification.
+        """
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+
+    @contextmanager
+    def waiter(self, channel: str, payload: str):
+        """
+        Yields a future, which is resolved when the notification is sent.
+
+        Register the waiter before checking the state of the database, then
+        no notification sent after the check can be missed.
+        """
+        key = (channel, payload)
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._waiters.setdefault(key, set()).add(future)
+        try:
+            yield future
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(key)
+                if waiters is not None:
+                    waiters.discard(future)
+                    if not waiters:
+                        del self._waiters[key]
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+notifier = Notifier()
+
+
+async def listen(engine, channels: list[str], target: Notifier = notifier):
+    """
+    Passes PostgreSQL notifications on the given channels to the notifier.
+
+    Runs until cancelled. If the connection is lost, reconnects after a delay.
+    Waiters fall back on their timeouts while no connection is available.
+    """
+    logger = logging.getLogger(__name__)
+
+    def forward(connection, pid, channel, payload):
+        target.notify(channel, payload)
+
+    while True:
+        try:
+            async with engine.connect() as conn:
+                raw_connection = await conn.get_raw_connection()
+                pg_connection = raw_connection.driver_connection
+                closed = asyncio.Event()
+                pg_connection.add_termination_listener(lambda c: closed.set())
+                for channel in channels:
+                    await pg_connection.add_listener(channel, forward)
+                logger.info(f"Listening to notifications on {channels}")
+                try:
+                    await closed.wait()
+                finally:
+                    # The connection goes back to the pool.
+                    if not pg_connection.is_closed():
+                        for channel in channels:
+                            await pg_connection.remove_listener(channel, forward)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Notification listener failed: {e}")
+        await asyncio.sleep(LISTENER_RECONNECT_DELAY)
@@ -28,8 +28,10 @@ from starlette import status
 
 from npg_porch.auth.token import validate
 from npg_porch.db.connection import get_DbAccessor
+from npg_porch.endpoints.responses import PorchJSONResponse
 from npg_porch.models.permission import RolesEnum
 from npg_porch.models.pipeline import Pipeline
+from npg_porch.models.task import PipelineStats
 from npg_porch.models.token import Token
 
 router = APIRouter(
@@ -56,7 +58,8 @@ async def get_pipelines(
     version: str | None = None,
     db_accessor=Depends(get_DbAccessor),
 ) -> list[Pipeline]:
-    return await db_accessor.get_all_pipelines(uri, version)
+    pipelines = await db_accessor.get_all_pipelines(uri, version)
+    return PorchJSONResponse(content=pipelines)
 
 
 @router.get(
@@ -81,6 +84,29 @@ async def get_pipeline(
     return pipeline
 
 
+@router.get(
+    "/{pipeline_name}/stats",
+    response_model=PipelineStats,
+    responses={status.HTTP_404_NOT_FOUND: {"description": "Not found"}},
+    summary="Get the number of tasks of a pipeline in each status.",
+    description="""
+    Returns a pydantic PipelineStats model with the number of tasks of the
+    pipeline in each status and in total. The numbers are read from counters
+    that are kept up to date as tasks are created and change status, the
+    tasks are not counted.""",
+)
+async def get_pipeline_stats(
+    pipeline_name: str, db_accessor=Depends(get_DbAccessor)
+) -> PipelineStats:
+    try:
+        stats = await db_accessor.get_pipeline_stats(pipeline_name)
+    except NoResultFound:
+        raise HTTPException(
+            status_code=404, detail=f"Pipeline '{pipeline_name}' not found"
+        )
+    return stats
+
+
 @router.post(
     "/{pipeline_name}/token/{token_desc}",
     response_model=Token,
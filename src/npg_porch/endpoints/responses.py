@@ -0,0 +1,41 @@
+# Copyright (C) 2026 Genome Research Ltd.
+#
+# This file is part of npg_porch
+#
+# npg_porch is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+JSON responses for listings.
+
+FastAPI validates the value returned by a route against its response model
+before serialising it. The models of a listing are built from database rows
+and need no validation, so routes returning listings return a
+PorchJSONResponse with the models instead.
+"""
+
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class PorchJSONResponse(JSONResponse):
+    """
+    A JSON response that serialises its content, which can contain pydantic
+    models, in one pass. The models are serialised by their own serialisers,
+    e.g. the dates of expanded tasks are formatted for display.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
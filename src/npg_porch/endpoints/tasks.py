@@ -18,19 +18,51 @@
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import binascii
 import logging
+import tempfile
+from collections.abc import AsyncIterator
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
+import ujson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm.exc import NoResultFound
 from starlette import status
 
 from npg_porch.auth.token import validate
-from npg_porch.db.connection import get_DbAccessor
+from npg_porch.db.connection import get_DbAccessor, open_DbAccessor
+from npg_porch.db.data_access import BULK_CHUNK_SIZE
+from npg_porch.endpoints.responses import PorchJSONResponse
 from npg_porch.models.permission import PermissionValidationException
 from npg_porch.models.pipeline import Pipeline
-from npg_porch.models.task import Task, TaskStateEnum
+from npg_porch.models.task import (
+    Task,
+    TaskCandidates,
+    TaskCreationResult,
+    TaskLease,
+    TaskStateEnum,
+    TaskStateTransitionException,
+    TaskStatus,
+    TaskField,
+    TaskUpdateResult,
+    generate_task_input_id,
+)
+
+# The longest time a claim request can wait for tasks, in seconds.
+MAX_CLAIM_WAIT = 30
+
+# The largest page of a task listing.
+MAX_PAGE_SIZE = 10000
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# The number of NDJSON lines to create tasks for at a time.
+NDJSON_BATCH_SIZE = BULK_CHUNK_SIZE
+# The size of the results of NDJSON task creation to keep in memory,
+# larger results are written to a temporary file.
+NDJSON_SPOOL_SIZE = 1024 * 1024
 
 
 def _validate_request(permission, pipeline):
@@ -49,6 +81,44 @@ def _validate_request(permission, pipeline):
         pass
 
 
+def _encode_cursor(task_id: int) -> str:
+    "Encodes the position after a task in a listing as an opaque cursor"
+    return base64.urlsafe_b64encode(ujson.dumps({"after": task_id}).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        return int(ujson.loads(base64.urlsafe_b64decode(cursor.encode()))["after"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _stream_tasks(**filters):
+    "Yields batches of tasks as lines of NDJSON, uses its own DB session"
+    async with open_DbAccessor() as db_accessor:
+        async for tasks in db_accessor.stream_tasks(**filters):
+            if filters.get("fields"):
+                lines = (ujson.dumps(task).encode() + b"\n" for task in tasks)
+            else:
+                lines = (task.model_dump_json().encode() + b"\n" for task in tasks)
+            yield b"".join(lines)
+
+
+async def _ndjson_lines(stream: AsyncIterator[bytes]):
+    "Yields numbered non-empty lines of a byte stream as it is received"
+    buffer = b""
+    line_number = 0
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield (line_number, line)
+    if buffer.strip():
+        yield (line_number + 1, buffer)
+
+
 router = APIRouter(
     prefix="/tasks",
     tags=["tasks"],
@@ -65,15 +135,60 @@ router = APIRouter(
     summary="Returns all tasks, and can be filtered to task status or pipeline name",
     description="""
     Return all tasks. The list of tasks can be filtered by supplying a pipeline
-    name and/or task status""",
+    name and/or task status.
+
+    Large lists can be fetched in pages by supplying a limit. The tasks are
+    then listed in the order of their creation. If there are more tasks, the
+    response has a Link header with the URL of the next page, which has an
+    opaque cursor parameter.
+
+    If newline-delimited JSON is accepted (application/x-ndjson), all tasks
+    are streamed one per line as they are read from the database, the limit
+    and cursor are not used.
+
+    The tasks can be limited to some of their fields, e.g. to leave out
+    large task inputs, by giving the fields parameter once for each field.""",
+    responses={
+        200: {"content": {NDJSON_MEDIA_TYPE: {}}},
+    },
 )
 async def get_tasks(
+    request: Request,
     pipeline_name: str | None = None,
     status: TaskStateEnum | None = None,
+    limit: Annotated[int | None, Query(gt=0, le=MAX_PAGE_SIZE)] = None,
+    cursor: str | None = None,
+    fields: Annotated[list[TaskField] | None, Query()] = None,
     db_accessor=Depends(get_DbAccessor),
 ) -> list[Task]:
     print(pipeline_name, status)
-    return await db_accessor.get_tasks(pipeline_name=pipeline_name, task_status=status)
+    filters = {
+        "pipeline_name": pipeline_name,
+        "task_status": status,
+        "fields": list(dict.fromkeys(fields)) if fields else None,
+    }
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(
+            _stream_tasks(**filters), media_type=NDJSON_MEDIA_TYPE
+        )
+
+    headers = {}
+    if limit is None and cursor is None:
+        tasks = await db_accessor.get_tasks(**filters)
+    else:
+        after = _decode_cursor(cursor) if cursor is not None else None
+        (tasks, next_after) = await db_accessor.get_task_page(
+            limit=limit, after=after, **filters
+        )
+        if next_after is not None:
+            next_url = request.url.include_query_params(
+                cursor=_encode_cursor(next_after)
+            )
+            headers["Link"] = f'<{next_url}>; rel="next"'
+
+    # Tasks from the database, and projected tasks, which are not valid Task
+    # objects, are serialised without validation.
+    return PorchJSONResponse(content=tasks, headers=headers)
 
 
 @router.post(
@@ -120,34 +235,339 @@ async def create_task(
     return JSONResponse(status_code=status.HTTP_200_OK, content=task.model_dump())
 
 
+@router.post(
+    "/bulk",
+    response_model=list[TaskCreationResult],
+    responses={
+        status.HTTP_200_OK: {"description": "Tasks were created or already existed"},
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Tasks do not belong to the same pipeline"
+        },
+        status.HTTP_404_NOT_FOUND: {"description": "Pipeline does not exist."},
+    },
+    summary="Creates many task records for one pipeline.",
+    description="""
+    Given a list of Task objects for the same pipeline, creates database
+    records for the tasks that do not exist yet. New tasks are assigned
+    pending status.
+
+    Returns a list with a result for each of the given tasks, in the same
+    order. Each result contains the Task object with the status currently
+    available in the database and a `created` flag, which is false if the
+    task already existed.""",
+)
+async def create_tasks(
+    tasks: list[Task], db_accessor=Depends(get_DbAccessor), permission=Depends(validate)
+) -> list[TaskCreationResult]:
+    if not tasks:
+        return []
+    pipeline = tasks[0].pipeline
+    if any(task.pipeline.name != pipeline.name for task in tasks):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="All tasks should belong to the same pipeline",
+        )
+    _validate_request(permission, pipeline)
+
+    try:
+        results = await db_accessor.create_tasks(
+            token_id=permission.requestor_id, pipeline_name=pipeline.name, tasks=tasks
+        )
+    except NoResultFound:
+        raise HTTPException(
+            status_code=404, detail="Failed to find pipeline for these tasks"
+        )
+
+    return PorchJSONResponse(content=results)
+
+
+@router.post(
+    "/unregistered",
+    response_model=TaskCandidates,
+    responses={
+        status.HTTP_200_OK: {"description": "Candidate tasks that do not exist"},
+        status.HTTP_404_NOT_FOUND: {"description": "Pipeline does not exist."},
+    },
+    summary="Filters candidate tasks of a pipeline down to the new ones.",
+    description="""
+    Given a pipeline and a list of candidate task inputs and/or task input
+    IDs, returns the candidates that are not registered for the pipeline,
+    in the given order and without repetitions. Task input IDs are computed
+    from task inputs in the same way as when creating a task.
+
+    Nothing is changed in the database, candidates returned by this request
+    still have to be registered.""",
+)
+async def get_unregistered_tasks(
+    candidates: TaskCandidates,
+    db_accessor=Depends(get_DbAccessor),
+    permission=Depends(validate),
+) -> TaskCandidates:
+    _validate_request(permission, candidates.pipeline)
+
+    task_input_ids = {
+        generate_task_input_id(task_input): task_input
+        for task_input in candidates.task_inputs
+    }
+    try:
+        registered = await db_accessor.get_registered_task_ids(
+            pipeline_name=candidates.pipeline.name,
+            task_input_ids=list(task_input_ids) + candidates.task_input_ids,
+        )
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="Pipeline does not exist.")
+
+    return TaskCandidates(
+        pipeline=candidates.pipeline,
+        task_inputs=[
+            task_input
+            for (task_input_id, task_input) in task_input_ids.items()
+            if task_input_id not in registered
+        ],
+        task_input_ids=[
+            task_input_id
+            for task_input_id in dict.fromkeys(candidates.task_input_ids)
+            if task_input_id not in registered
+        ],
+    )
+
+
+@router.post(
+    "/bulk/ndjson",
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "One result line per input line",
+            "content": {NDJSON_MEDIA_TYPE: {}},
+        },
+    },
+    openapi_extra={
+        "requestBody": {
+            "content": {NDJSON_MEDIA_TYPE: {"schema": Task.model_json_schema()}},
+            "required": True,
+        }
+    },
+    summary="Creates task records from a stream of newline-delimited JSON.",
+    description="""
+    The request body is newline-delimited JSON, one Task object per line.
+    The tasks should belong to the pipeline of the token. Tasks are created
+    in batches as the body is received, the whole body is never held in
+    memory, so there is no limit on the number of tasks.
+
+    The response is newline-delimited JSON with one result per non-empty
+    input line, in the same order. A result has the input `line` number and
+    either the `task_input_id`, current `status` and `created` flag of the
+    task, or an `error` message if the line is not a valid task for the
+    pipeline.""",
+)
+async def create_tasks_from_ndjson(
+    request: Request,
+    db_accessor=Depends(get_DbAccessor),
+    permission=Depends(validate),
+) -> StreamingResponse:
+    # Tasks are created for the pipeline of the token, other tokens are
+    # refused before the request body is read.
+    if permission.pipeline is None:
+        logging.getLogger(__name__).warning(
+            f"Token of role {permission.role} is not associated with a pipeline"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Given credentials are not associated with a pipeline",
+        )
+
+    # The results are written out once the whole request is received.
+    # Sending them while the client is still uploading can deadlock clients
+    # that do not read the response until they have sent the request.
+    results = tempfile.SpooledTemporaryFile(max_size=NDJSON_SPOOL_SIZE)
+
+    async def create_batch(batch):
+        valid = [(line, task) for (line, task) in batch if isinstance(task, Task)]
+        created = await db_accessor.create_tasks(
+            token_id=permission.requestor_id,
+            pipeline_name=permission.pipeline.name,
+            tasks=[task for (_, task) in valid],
+        )
+        outcomes = dict(zip((line for (line, _) in valid), created))
+        for line, task in batch:
+            if line in outcomes:
+                result = {
+                    "line": line,
+                    "task_input_id": outcomes[line].task.task_input_id,
+                    "status": outcomes[line].task.status,
+                    "created": outcomes[line].created,
+                }
+            else:
+                result = {"line": line, "error": task}
+            results.write(ujson.dumps(result).encode() + b"\n")
+
+    batch = []
+    async for line, content in _ndjson_lines(request.stream()):
+        try:
+            task = Task.model_validate_json(content)
+            permission.validate_pipeline(task.pipeline)
+        except ValidationError as e:
+            task = f"Invalid task: {e.errors()[0]['msg']}"
+        except PermissionValidationException as e:
+            task = str(e)
+        batch.append((line, task))
+        if len(batch) == NDJSON_BATCH_SIZE:
+            await create_batch(batch)
+            batch = []
+    if batch:
+        await create_batch(batch)
+
+    def read_results():
+        with results:
+            results.seek(0)
+            yield from results
+
+    return StreamingResponse(read_results(), media_type=NDJSON_MEDIA_TYPE)
+
+
 @router.put(
     "/",
     response_model=Task,
     responses={
         status.HTTP_200_OK: {"description": "Task was modified"},
+        status.HTTP_409_CONFLICT: {
+            "description": "The status of the task does not allow the change"
+        },
     },
     summary="Update one task.",
     description="""
     Given a Task object, updates the status of the task in the database
     to the value of the status in this Task object.
 
+    The change has to be allowed for the current status of the task, e.g.
+    a CLAIMED task can become RUNNING, but a DONE task can only be moved
+    back to PENDING. A PENDING task can only be claimed or cancelled, and
+    a CLAIMED or RUNNING task cannot be given its current status again, so
+    only one of two workers updating the same task succeeds. If the optional
+    expected_status is given, the task is only updated if it currently has
+    this status. The status is checked and changed in one step, if the check
+    fails, status 409 'Conflict' is returned.
+
     If the task does not exist, status 404 'Not found' is returned.""",
 )
 async def update_task(
-    task: Task, db_accessor=Depends(get_DbAccessor), permission=Depends(validate)
+    task: Task,
+    expected_status: TaskStateEnum | None = None,
+    db_accessor=Depends(get_DbAccessor),
+    permission=Depends(validate),
 ) -> Task:
     _validate_request(permission, task.pipeline)
 
     try:
         changed_task = await db_accessor.update_task(
-            token_id=permission.requestor_id, task=task
+            token_id=permission.requestor_id,
+            task=task,
+            expected_status=expected_status,
         )
     except NoResultFound as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except TaskStateTransitionException as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
 
     return changed_task
 
 
+@router.put(
+    "/bulk",
+    response_model=list[TaskUpdateResult],
+    responses={
+        status.HTTP_200_OK: {"description": "Tasks were modified or not found"},
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Tasks do not belong to the same pipeline"
+        },
+        status.HTTP_404_NOT_FOUND: {"description": "Pipeline does not exist."},
+    },
+    summary="Update many tasks of one pipeline.",
+    description="""
+    Given a list of Task objects for the same pipeline, updates the status
+    and, optionally, the priority of the tasks in the database in one
+    transaction. A task is identified by its task input or, if the task
+    input is not given, by its task input ID.
+
+    Returns a list with a result for each of the given tasks, in the same
+    order. Tasks that do not exist or whose status does not allow the change
+    are reported as not updated, the other tasks are updated nevertheless.""",
+)
+async def update_tasks(
+    tasks: list[Task], db_accessor=Depends(get_DbAccessor), permission=Depends(validate)
+) -> list[TaskUpdateResult]:
+    if not tasks:
+        return []
+    pipeline = tasks[0].pipeline
+    if any(task.pipeline.name != pipeline.name for task in tasks):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="All tasks should belong to the same pipeline",
+        )
+    if any(task.task_input is None and task.task_input_id is None for task in tasks):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either the task input or the task input ID should be given",
+        )
+    _validate_request(permission, pipeline)
+
+    try:
+        results = await db_accessor.update_tasks(
+            token_id=permission.requestor_id, pipeline_name=pipeline.name, tasks=tasks
+        )
+    except NoResultFound:
+        raise HTTPException(
+            status_code=404, detail="Failed to find pipeline for these tasks"
+        )
+
+    return PorchJSONResponse(content=results)
+
+
+@router.patch(
+    "/{pipeline_name}/{task_input_id}",
+    response_model=TaskUpdateResult,
+    responses={
+        status.HTTP_200_OK: {"description": "Task was modified"},
+        status.HTTP_404_NOT_FOUND: {"description": "Task does not exist"},
+        status.HTTP_409_CONFLICT: {
+            "description": "The status of the task does not allow the change"
+        },
+    },
+    summary="Update the status of one task given its task input ID.",
+    description="""
+    Arguments - the pipeline name, the task_input_id of the task and a body
+    with the new status and, optionally, the expected current status of the
+    task.
+
+    Unlike updating the task with a Task object, the task input is neither
+    sent nor returned. The status change is checked in the same way. If the
+    task does not exist, status 404 'Not found' is returned.""",
+)
+async def update_task_status(
+    pipeline_name: str,
+    task_input_id: str,
+    task_status: TaskStatus,
+    db_accessor=Depends(get_DbAccessor),
+    permission=Depends(validate),
+) -> TaskUpdateResult:
+    _validate_request(permission, Pipeline(name=pipeline_name))
+
+    try:
+        result = await db_accessor.update_task_status(
+            token_id=permission.requestor_id,
+            pipeline_name=pipeline_name,
+            task_input_id=task_input_id,
+            new_status=task_status.status,
+            expected_status=task_status.expected_status,
+        )
+    except NoResultFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except TaskStateTransitionException as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    return result
+
+
 @router.post(
     "/claim",
     response_model=list[Task],
@@ -164,6 +584,17 @@ async def update_task(
     If no tasks that satisfy the given criteria and are unclaimed
     are found, returns status 200 and an empty array.
 
+    Optionally, the number of seconds (up to 30) to wait for tasks to
+    become available can be given. The request is then held open until
+    some tasks of this pipeline are created or become pending again and
+    these tasks are claimed, or until the time runs out and an empty array
+    is returned.
+
+    Optionally, a lease duration in seconds can be given. Unless the task
+    is finished, or its lease is extended with the heartbeat endpoint,
+    before the lease expires, the task is returned to the pending state
+    and can be claimed again.
+
     If any tasks are claimed, return an array of these Task objects
     and status 200.
 
@@ -174,12 +605,54 @@ async def update_task(
 async def claim_task(
     pipeline: Pipeline,
     num_tasks: Annotated[int | None, Query(gt=0)] = 1,
+    wait: Annotated[float, Query(ge=0, le=MAX_CLAIM_WAIT)] = 0,
+    lease: Annotated[int | None, Query(gt=0)] = None,
     db_accessor=Depends(get_DbAccessor),
     permission=Depends(validate),
 ) -> list[Task]:
     _validate_request(permission, pipeline)
     tasks = await db_accessor.claim_tasks(
-        token_id=permission.requestor_id, pipeline=pipeline, claim_limit=num_tasks
+        token_id=permission.requestor_id,
+        pipeline=pipeline,
+        claim_limit=num_tasks,
+        wait=wait,
+        lease=lease,
     )
 
-    return tasks
+    return PorchJSONResponse(content=tasks)
+
+
+@router.post(
+    "/{pipeline_name}/{task_input_id}/heartbeat",
+    response_model=TaskLease,
+    responses={
+        status.HTTP_200_OK: {"description": "The lease was extended"},
+        status.HTTP_404_NOT_FOUND: {
+            "description": "No claimed or running task with this ID"
+        },
+    },
+    summary="Extend the lease of a claimed or running task.",
+    description="""
+    Arguments - the pipeline name, the task_input_id of a claimed or
+    running task and the lease duration in seconds.
+
+    Sets the lease of the task to expire after the given number of seconds
+    from now and returns the new expiry time. No event is recorded.""",
+)
+async def extend_lease(
+    pipeline_name: str,
+    task_input_id: str,
+    lease: Annotated[int, Query(gt=0)],
+    db_accessor=Depends(get_DbAccessor),
+    permission=Depends(validate),
+) -> TaskLease:
+    _validate_request(permission, Pipeline(name=pipeline_name))
+
+    try:
+        task_lease = await db_accessor.extend_lease(
+            pipeline_name=pipeline_name, task_input_id=task_input_id, lease=lease
+        )
+    except NoResultFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    return task_lease
@@ -18,11 +18,14 @@
 # this program. If not, see <http://www.gnu.org/licenses/>.
 from datetime import datetime
 from enum import Enum
-from fastapi import APIRouter, Depends, Request
+from typing import Annotated
+from fastapi import APIRouter, Depends, Query, Request
 from starlette import status
 
 from npg_porch.db.connection import get_DbAccessor
+from npg_porch.endpoints.responses import PorchJSONResponse
 from npg_porch.models import TaskStateEnum
+from npg_porch.models.task import TaskExpandedField, format_timestamp
 
 
 class UiStateEnum(str, Enum):
@@ -42,17 +45,41 @@ router = APIRouter(
 )
 
 
+def _datatables_order(params) -> list[tuple[str, bool]]:
+    """
+    Returns the (column data, descending) pairs of the order parameters of
+    a DataTables server-side processing request.
+    """
+    order = []
+    i = 0
+    while (column := params.get(f"order[{i}][column]")) is not None:
+        data = params.get(f"columns[{column}][data]")
+        if data:
+            order.append((data, params.get(f"order[{i}][dir]") == "desc"))
+        i += 1
+    return order
+
+
 @router.get(
     "/tasks/{pipeline_name}/{state}/{since}",
     response_model=dict,
     summary="Returns all expanded tasks for the specified pipeline and status "
     "in a displayable format for the ui",
+    description="""
+    Supports the server-side processing protocol of DataTables. If the start
+    parameter is given, only the page of tasks of the given length from this
+    start is returned. The tasks are then ordered by the order parameters
+    and searched for the search[value] parameter. Otherwise all tasks are
+    returned.""",
 )
 async def get_ui_tasks(
     request: Request,
     pipeline_name: str,
     state: TaskStateEnum | UiStateEnum,
     since: datetime,
+    fields: Annotated[list[TaskExpandedField] | None, Query()] = None,
+    start: Annotated[int | None, Query(ge=0)] = None,
+    length: int = -1,
     db_accessor=Depends(get_DbAccessor),
 ) -> dict:
     pipeline_name = None if pipeline_name == "All" else pipeline_name
@@ -69,8 +96,37 @@ async def get_ui_tasks(
         if state == UiStateEnum.ALL
         else [state]
     )
-    task_list = await db_accessor.get_expanded_tasks(pipeline_name, state, since)
-    return {"draw": params("draw"), "recordsTotal": len(task_list), "data": task_list}
+    fields = list(dict.fromkeys(fields)) if fields else None
+    if start is None:
+        task_list = await db_accessor.get_expanded_tasks(
+            pipeline_name, state, since, fields=fields
+        )
+        total = filtered = len(task_list)
+    else:
+        (task_list, total, filtered) = await db_accessor.get_expanded_task_page(
+            pipeline_name,
+            state,
+            since,
+            start=start,
+            # A negative length means all tasks.
+            length=length if length >= 0 else None,
+            order=_datatables_order(request.query_params),
+            search=params("search[value]"),
+            fields=fields,
+        )
+    if fields:
+        for task in task_list:
+            for field in ("created", "updated"):
+                if task.get(field) is not None:
+                    task[field] = format_timestamp(task[field])
+    return PorchJSONResponse(
+        content={
+            "draw": params("draw"),
+            "recordsTotal": total,
+            "recordsFiltered": filtered,
+            "data": task_list,
+        }
+    )
 
 
 @router.get(
@@ -83,4 +139,10 @@ async def get_long_running_ui_tasks(
 ) -> dict:
     params = request.query_params.get
     task_list = await db_accessor.get_long_running_tasks()
-    return {"draw": params("draw"), "recordsTotal": len(task_list), "data": task_list}
+    return PorchJSONResponse(
+        content={
+            "draw": params("draw"),
+            "recordsTotal": len(task_list),
+            "data": task_list,
+        }
+    )
@@ -20,12 +20,18 @@
 from datetime import datetime
 from enum import Enum
 import hashlib
+from typing import Literal
 import ujson
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import BaseModel, Field, ValidationError, field_serializer
 
 from npg_porch.models.pipeline import Pipeline
 
 
+def generate_task_input_id(task_input: dict) -> str:
+    "Returns a unique identifier of a task input, independent of the key order"
+    return hashlib.sha256(ujson.dumps(task_input, sort_keys=True).encode()).hexdigest()
+
+
 class TaskStateEnum(str, Enum):
     def __str__(self):
         return self.value
@@ -38,6 +44,57 @@ class TaskStateEnum(str, Enum):
     CANCELLED = "CANCELLED"
 
 
+class TaskStateTransitionException(Exception):
+    pass
+
+
+# The states a task can be moved to from each state. Only claims move
+# pending tasks on, a claimed or running task cannot be moved to the state
+# it is in, so that of two workers updating a task, one gets a conflict.
+# Finished tasks can be moved back to PENDING to be rerun and can be moved
+# to the state they are in.
+TASK_STATE_TRANSITIONS = {
+    TaskStateEnum.PENDING: {
+        TaskStateEnum.PENDING,
+        TaskStateEnum.CLAIMED,
+        TaskStateEnum.CANCELLED,
+    },
+    TaskStateEnum.CLAIMED: {
+        TaskStateEnum.RUNNING,
+        TaskStateEnum.DONE,
+        TaskStateEnum.FAILED,
+        TaskStateEnum.PENDING,
+        TaskStateEnum.CANCELLED,
+    },
+    TaskStateEnum.RUNNING: {
+        TaskStateEnum.DONE,
+        TaskStateEnum.FAILED,
+        TaskStateEnum.PENDING,
+        TaskStateEnum.CANCELLED,
+    },
+    TaskStateEnum.DONE: {TaskStateEnum.DONE, TaskStateEnum.PENDING},
+    TaskStateEnum.FAILED: {
+        TaskStateEnum.FAILED,
+        TaskStateEnum.PENDING,
+        TaskStateEnum.CANCELLED,
+    },
+    TaskStateEnum.CANCELLED: {TaskStateEnum.CANCELLED, TaskStateEnum.PENDING},
+}
+
+
+def is_allowed_transition(old_status: TaskStateEnum, new_status: TaskStateEnum):
+    return new_status in TASK_STATE_TRANSITIONS[old_status]
+
+
+def allowed_previous_states(new_status: TaskStateEnum) -> list[TaskStateEnum]:
+    "Returns the states from which a task can be moved to the given state"
+    return [
+        old_status
+        for old_status in TaskStateEnum
+        if is_allowed_transition(old_status, new_status)
+    ]
+
+
 class Task(BaseModel):
     pipeline: Pipeline
     task_input_id: str | None = Field(
@@ -51,11 +108,14 @@ class Task(BaseModel):
         description="A structured parameter set that uniquely identifies a piece of work, and enables an iteration of a pipeline",  # noqa: E501
     )
     status: TaskStateEnum
+    priority: int | None = Field(
+        None,
+        title="Priority",
+        description="Pending tasks with higher priority are claimed first. New tasks have priority 0 unless given, an update leaves the priority unchanged unless given",  # noqa: E501
+    )
 
     def generate_task_id(self):
-        return hashlib.sha256(
-            ujson.dumps(self.task_input, sort_keys=True).encode()
-        ).hexdigest()
+        return generate_task_input_id(self.task_input)
 
     def __eq__(self, other):
         """
@@ -95,6 +155,120 @@ class Task(BaseModel):
         return False
 
 
+class TaskCreationResult(BaseModel):
+    task: Task = Field(
+        title="Task",
+        description="The task as it is stored, with its current status",
+    )
+    created: bool = Field(
+        title="Created",
+        description="True if the task was created, False if it already existed",
+    )
+
+
+class TaskStatus(BaseModel):
+    status: TaskStateEnum = Field(
+        title="Status",
+        description="The new status of the task",
+    )
+    expected_status: TaskStateEnum | None = Field(
+        None,
+        title="Expected Status",
+        description="If given, the task is only updated if it currently has this status",  # noqa: E501
+    )
+
+
+class TaskUpdateResult(BaseModel):
+    task_input_id: str = Field(
+        title="Task Input ID",
+        description="A stringified unique identifier for a piece of work",
+    )
+    status: TaskStateEnum = Field(
+        title="Status",
+        description="The requested status of the task",
+    )
+    updated: bool = Field(
+        title="Updated",
+        description="True if the task was updated",
+    )
+    detail: str | None = Field(
+        None,
+        title="Detail",
+        description="The reason why the task was not updated",
+    )
+
+
+class TaskCandidates(BaseModel):
+    pipeline: Pipeline
+    task_inputs: list[dict] = Field(
+        [],
+        title="Task Inputs",
+        description="Task inputs of candidate tasks",
+    )
+    task_input_ids: list[str] = Field(
+        [],
+        title="Task Input IDs",
+        description="Task input IDs of candidate tasks, as computed by the server from their task inputs",  # noqa: E501
+    )
+
+
+class TaskLease(BaseModel):
+    task_input_id: str = Field(
+        title="Task Input ID",
+        description="A stringified unique identifier for a piece of work",
+    )
+    lease_expires: datetime = Field(
+        title="Lease Expires",
+        description="The time after which the task is returned to the pending state, unless the lease is extended",  # noqa: E501
+    )
+
+
+class TaskDurationStats(BaseModel):
+    count: int = Field(
+        title="Count", description="The number of tasks that have become DONE"
+    )
+    mean: float | None = Field(
+        default=None,
+        title="Mean",
+        description="The mean time in seconds from the creation of a task to its completion",  # noqa: E501
+    )
+    stdev: float | None = Field(
+        default=None,
+        title="Standard Deviation",
+        description="The standard deviation of the times in seconds, at least two tasks are needed",  # noqa: E501
+    )
+    histogram: dict[str, int] = Field(
+        title="Histogram",
+        description="The number of tasks that took up to 1m, 10m, 1h, 6h, 1d, 7d or longer",  # noqa: E501
+    )
+
+
+class PipelineStats(BaseModel):
+    pipeline: str = Field(title="Pipeline Name", description="The name of the pipeline")
+    counts: dict[TaskStateEnum, int] = Field(
+        title="Task Counts",
+        description="The number of tasks of the pipeline in each status",
+    )
+    total: int = Field(
+        title="Total", description="The number of tasks of the pipeline"
+    )
+    durations: TaskDurationStats | None = Field(
+        default=None,
+        title="Durations",
+        description="Statistics of the time from creation to completion of DONE tasks",  # noqa: E501
+    )
+
+
+# Fields of the Task and TaskExpanded models that listings can be limited to.
+TaskField = Literal["pipeline", "task_input_id", "task_input", "status", "priority"]
+TaskExpandedField = Literal[TaskField, "created", "updated"]
+
+
+def format_timestamp(timestamp: datetime) -> str:
+    "Formats a timestamp for display in a web page"
+    return timestamp.strftime("%Y-%m-%d\u00A0%H:%M:%S")
+
+
 class TaskExpanded(Task):
     """
     An expanded task model for serving a web page.
@@ -113,5 +287,6 @@ class TaskExpanded(Task):
         description="The timestamp of task status update",
     )
 
-    class Config:
-        json_encoders = {datetime: lambda v: v.strftime("%Y-%m-%d\u00A0%H:%M:%S")}
+    @field_serializer("created", "updated", when_used="json-unless-none")
+    def serialize_timestamp(self, timestamp: datetime) -> str:
+        return format_timestamp(timestamp)
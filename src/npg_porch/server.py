@@ -17,19 +17,27 @@
 #
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from importlib import metadata
 
 from fastapi import FastAPI, Request, Depends
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import (
     Response,
     HTMLResponse,
     RedirectResponse,
 )
 from fastapi.templating import Jinja2Templates
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
 from jinja2 import Environment, PackageLoader
 
-from npg_porch.db.connection import get_DbAccessor
+from npg_porch.db.connection import (
+    get_DbAccessor,
+    start_lease_reaper,
+    start_notification_listener,
+)
 from npg_porch.endpoints import pipelines, tasks, ui
 from npg_porch.models import TaskStateEnum
 
@@ -38,6 +46,16 @@ from npg_porch.models import TaskStateEnum
 
 RECENT = datetime.now() - timedelta(days=14)
 
+# Responses of at least this size, in bytes, are compressed for clients that
+# accept gzip. Large task listings shrink by an order of magnitude. Higher
+# levels take several times longer for little gain. Streamed NDJSON is not
+# compressed, the compressor would hold lines back until its buffer fills.
+GZIP_MINIMUM_SIZE = 64 * 1024
+GZIP_COMPRESS_LEVEL = 6
+GZIP_EXCLUDED_CONTENT_TYPES = DEFAULT_EXCLUDED_CONTENT_TYPES + (
+    tasks.NDJSON_MEDIA_TYPE,
+)
+
 tags_metadata = [
     {
         "name": "pipelines",
@@ -53,10 +71,30 @@ tags_metadata = [
     },
 ]
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    background_tasks = [start_lease_reaper()]
+    listener = start_notification_listener()
+    if listener is not None:
+        background_tasks.append(listener)
+    yield
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+
 app = FastAPI(
     title="Pipeline Orchestration (POrch)",
     openapi_url="/api/v1/openapi.json",
     openapi_tags=tags_metadata,
+    lifespan=lifespan,
+)
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=GZIP_MINIMUM_SIZE,
+    compresslevel=GZIP_COMPRESS_LEVEL,
+    exclude_content_types=GZIP_EXCLUDED_CONTENT_TYPES,
 )
 app.include_router(pipelines.router)
 app.include_router(tasks.router)
@@ -113,6 +151,7 @@ async def root(
         "listing.j2",
         {
             "endpoint": endpoint,
+            "server_side": True,
             "pipeline_name": pipeline_name,
             "task_status": task_status,
             "pipelines": pipeline_list,
@@ -153,6 +192,7 @@ async def recently_failed(request: Request) -> HTMLResponse:
         "listing.j2",
         {
             "endpoint": f"/ui/tasks/All/{TaskStateEnum.FAILED}/{RECENT}",
+            "server_side": True,
             "pipeline_name": "Recently Failed",
             "request": request,
             "version": version,
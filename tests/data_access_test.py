@@ -1,14 +1,32 @@
+import asyncio
 import re
 import time
 from datetime import datetime, timedelta
+from statistics import mean, stdev
 
 import pytest
+import npg_porch.db.data_access
 from npg_porch.db.data_access import AsyncDbAccessor
 from npg_porch.models import Pipeline as ModelledPipeline
 from npg_porch.models import Task, TaskStateEnum
+from npg_porch.models.task import TaskStateTransitionException
 from pydantic import ValidationError
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.sql.functions import count
+
+from npg_porch.db.maintenance import rebuild_task_durations
+from npg_porch.db.models import Pipeline as DbPipeline
+from npg_porch.db.models import Task as DbTask
+from npg_porch.db.models import TaskDuration
+from npg_porch.db.notification import (
+    PIPELINE_CHANNEL,
+    TASK_CHANNEL,
+    Notifier,
+    notifier,
+)
 
 
 def give_me_a_pipeline(number: int = 1):
@@ -25,6 +43,14 @@ async def store_me_a_pipeline(
     return await dac.create_pipeline(give_me_a_pipeline(number))
 
 
+async def move_me_a_task(dac: AsyncDbAccessor, task: Task) -> Task:
+    "Claims a pending task, then changes its status to the one of the task"
+    await dac.update_task(
+        1, task.model_copy(update={"status": TaskStateEnum.CLAIMED})
+    )
+    return await dac.update_task(1, task)
+
+
 def test_data_accessor_setup(async_session):
     with pytest.raises(TypeError):
         dac = AsyncDbAccessor()
@@ -97,7 +123,12 @@ async def test_create_pipeline(db_accessor):
 
 
 @pytest.mark.asyncio
-async def test_create_task(db_accessor):
+async def test_create_task(db_accessor, monkeypatch):
+    task_notifications = []
+    test_notifier = Notifier()
+    test_notifier.subscribe(TASK_CHANNEL, task_notifications.append)
+    monkeypatch.setattr(npg_porch.db.data_access, "notifier", test_notifier)
+
     # create task with no pipeline
     with pytest.raises(ValidationError):
         await db_accessor.create_task(token_id=1, task=Task(task_input={"test": True}))
@@ -129,6 +160,78 @@ async def test_create_task(db_accessor):
     events = await db_accessor.get_events_for_task(existing_task)
     assert len(events) == 1, "No additional events"
 
+    # Nothing is left over from the existing task for the next commit.
+    await store_me_a_pipeline(db_accessor, 2)
+    assert task_notifications == ["ptest 1"], "Only the new task is notified"
+    stats = await db_accessor.get_pipeline_stats("ptest 1")
+    assert stats.counts[TaskStateEnum.PENDING] == 1
+    assert stats.total == 1
+
+
+@pytest.mark.asyncio
+async def test_create_tasks(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+
+    with pytest.raises(NoResultFound):
+        await db_accessor.create_tasks(1, "not here", [])
+
+    (existing, _) = await db_accessor.create_task(
+        token_id=1,
+        task=Task(
+            task_input={"number": 2}, pipeline=pipeline, status=TaskStateEnum.PENDING
+        ),
+    )
+    await db_accessor.claim_tasks(1, pipeline, 1)
+    existing.status = TaskStateEnum.RUNNING
+    await db_accessor.update_task(1, existing)
+
+    tasks = [
+        Task(
+            task_input={"number": i},
+            pipeline=pipeline,
+            status=TaskStateEnum.PENDING,
+            priority=i,
+        )
+        for i in [1, 2, 3, 1]
+    ]
+    results = await db_accessor.create_tasks(1, pipeline.name, tasks)
+
+    assert [r.created for r in results] == [True, False, True, False]
+    assert [r.task.task_input for r in results] == [t.task_input for t in tasks]
+    assert results[0].task.status == TaskStateEnum.PENDING
+    assert results[0].task.priority == 1
+    assert results[0].task.task_input_id == tasks[0].generate_task_id()
+    assert results[1].task.status == TaskStateEnum.RUNNING, "Current status"
+    assert results[3].task == results[0].task, "Duplicate reported as existing"
+
+    events = await db_accessor.get_events_for_task(results[2].task)
+    assert [e.change for e in events] == ["Created"]
+    events = await db_accessor.get_events_for_task(results[1].task)
+    assert len(events) == 3, "No events for existing tasks"
+
+    assert len(await db_accessor.get_tasks(pipeline_name=pipeline.name)) == 3
+
+
+@pytest.mark.asyncio
+async def test_get_registered_task_ids(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+
+    with pytest.raises(NoResultFound):
+        await db_accessor.get_registered_task_ids("not here", [])
+
+    tasks = [
+        Task(task_input={"number": i}, pipeline=pipeline, status=TaskStateEnum.PENDING)
+        for i in range(3)
+    ]
+    await db_accessor.create_tasks(1, pipeline.name, tasks[:2])
+    task_ids = [t.generate_task_id() for t in tasks]
+
+    registered = await db_accessor.get_registered_task_ids(
+        pipeline.name, task_ids + task_ids[:1] + ["unknown"]
+    )
+    assert registered == set(task_ids[:2])
+    assert await db_accessor.get_registered_task_ids(pipeline.name, []) == set()
+
 
 @pytest.mark.asyncio
 async def test_claim_tasks(db_accessor):
@@ -213,6 +316,220 @@ async def test_multi_claim_tasks(db_accessor):
         assert t.task_input == {"number": i}
 
 
+@pytest.mark.asyncio
+async def test_claim_tasks_statement_count(db_accessor):
+    "The number of statements does not depend on the number of claimed tasks"
+
+    pipeline = await store_me_a_pipeline(db_accessor)
+    for i in range(20):
+        await db_accessor.create_task(
+            token_id=1,
+            task=Task(
+                task_input={"number": i + 1},
+                pipeline=pipeline,
+                status=TaskStateEnum.PENDING,
+            ),
+        )
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db_accessor.session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        tasks = await db_accessor.claim_tasks(1, pipeline, 2)
+        assert len(tasks) == 2
+        num_statements = len(statements)
+        statements.clear()
+        tasks = await db_accessor.claim_tasks(1, pipeline, 15)
+        assert len(tasks) == 15
+        assert len(statements) == num_statements, "Same number of statements"
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+
+    assert [t.task_input["number"] for t in tasks] == list(
+        range(3, 18)
+    ), "Tasks are returned in the order of creation"
+    events = await db_accessor.get_events_for_task(tasks[-1])
+    assert [e.change for e in events] == ["Created", "Task claimed"]
+
+
+@pytest.mark.asyncio
+async def test_claim_tasks_with_wait(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+
+    start = time.monotonic()
+    tasks = await db_accessor.claim_tasks(1, pipeline, wait=0.2)
+    assert tasks == [], "No tasks to claim after waiting"
+    assert time.monotonic() - start >= 0.2, "Waited for tasks"
+
+    async def create_task_later():
+        await asyncio.sleep(0.2)
+        await db_accessor.create_task(
+            token_id=1,
+            task=Task(
+                task_input={"number": 1},
+                pipeline=pipeline,
+                status=TaskStateEnum.PENDING,
+            ),
+        )
+
+    start = time.monotonic()
+    (tasks, _) = await asyncio.gather(
+        db_accessor.claim_tasks(1, pipeline, wait=10), create_task_later()
+    )
+    assert len(tasks) == 1, "A task created while waiting is claimed"
+    assert tasks[0].task_input == {"number": 1}
+    assert time.monotonic() - start < 5, "Woken up by the new task"
+
+    async def reset_task_later():
+        await asyncio.sleep(0.2)
+        tasks[0].status = TaskStateEnum.PENDING
+        await db_accessor.update_task(1, tasks[0])
+
+    (reclaimed, _) = await asyncio.gather(
+        db_accessor.claim_tasks(1, pipeline, wait=10), reset_task_later()
+    )
+    assert len(reclaimed) == 1, "A task that is pending again is claimed"
+    assert time.monotonic() - start < 10, "Woken up by the status update"
+
+
+@pytest.mark.asyncio
+async def test_task_leases(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+    for i in range(3):
+        await db_accessor.create_task(
+            token_id=1,
+            task=Task(
+                task_input={"number": i + 1},
+                pipeline=pipeline,
+                status=TaskStateEnum.PENDING,
+            ),
+        )
+
+    with pytest.raises(NoResultFound):
+        await db_accessor.extend_lease(
+            pipeline.name,
+            (await db_accessor.get_tasks(pipeline_name=pipeline.name))[0].task_input_id,
+            60,
+        )
+
+    leased = await db_accessor.claim_tasks(1, pipeline, 2, lease=60)
+    unleased = await db_accessor.claim_tasks(2, pipeline, 1)
+    assert len(leased) == 2
+    assert len(unleased) == 1
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db_accessor.session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        assert await db_accessor.reap_expired_leases() == 0, "Leases have not expired"
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+    assert any(
+        "IN ('CLAIMED', 'RUNNING')" in s for s in statements
+    ), "Leased states are literals"
+
+    later = datetime.now() + timedelta(seconds=120)
+    task_lease = await db_accessor.extend_lease(
+        pipeline.name, leased[0].task_input_id, 600
+    )
+    assert task_lease.task_input_id == leased[0].task_input_id
+    assert task_lease.lease_expires > later, "Lease is extended"
+
+    assert (
+        await db_accessor.reap_expired_leases(now=later) == 1
+    ), "One task with an expired lease is reaped"
+    tasks = await db_accessor.get_tasks(
+        pipeline_name=pipeline.name, task_status=TaskStateEnum.PENDING
+    )
+    assert [t.task_input_id for t in tasks] == [leased[1].task_input_id]
+    events = await db_accessor.get_events_for_task(leased[1])
+    assert events[-1].change == "Task lease expired, new status PENDING"
+    assert events[-1].token_id == 1, "Recorded under the token of the claim"
+
+    # A finished task loses its lease.
+    leased[0].status = TaskStateEnum.DONE
+    await db_accessor.update_task(1, leased[0])
+    assert await db_accessor.reap_expired_leases(now=later + timedelta(hours=1)) == 0
+    with pytest.raises(NoResultFound):
+        await db_accessor.extend_lease(pipeline.name, leased[0].task_input_id, 60)
+
+    reclaimed = await db_accessor.claim_tasks(2, pipeline, 1)
+    assert reclaimed[0].task_input_id == leased[1].task_input_id
+
+
+@pytest.mark.asyncio
+async def test_claim_tasks_by_priority(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+    for i, priority in enumerate([None, 0, 5, None, 10]):
+        (task, _) = await db_accessor.create_task(
+            token_id=1,
+            task=Task(
+                task_input={"number": i + 1},
+                pipeline=pipeline,
+                status=TaskStateEnum.PENDING,
+                priority=priority,
+            ),
+        )
+        assert task.priority == (priority or 0), "Priority defaults to 0"
+
+    # Raise the priority of the oldest task, the status is not changed.
+    await db_accessor.update_task(
+        1,
+        Task(
+            task_input={"number": 1},
+            pipeline=pipeline,
+            status=TaskStateEnum.PENDING,
+            priority=5,
+        ),
+    )
+    # An update without priority keeps the priority.
+    (task, _) = await db_accessor.create_task(
+        1,
+        Task(
+            task_input={"number": 5},
+            pipeline=pipeline,
+            status=TaskStateEnum.PENDING,
+        ),
+    )
+    task = await db_accessor.update_task(1, task)
+    assert task.priority == 10
+
+    tasks = await db_accessor.claim_tasks(1, pipeline, 3)
+    assert [t.task_input["number"] for t in tasks] == [
+        5,
+        1,
+        3,
+    ], "Claimed by priority, then by creation"
+    tasks = await db_accessor.claim_tasks(1, pipeline, 3)
+    assert [t.task_input["number"] for t in tasks] == [2, 4]
+
+
+def test_claim_candidates_query():
+    "The candidate tasks are locked without waiting for other claimers"
+
+    query = AsyncDbAccessor._claim_candidates_query(pipeline_id=1, claim_limit=5)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert sql.endswith("FOR UPDATE OF task SKIP LOCKED"), "Only task rows are locked"
+    assert "JOIN" not in sql, "Pipeline table is not joined"
+    assert (
+        "task.state = 'PENDING'" in sql
+    ), "The state is a literal, matching the predicate of idx_claimable_tasks"
+
+    query = AsyncDbAccessor._claim_candidates_query(
+        pipeline_id=1, claim_limit=5, skip_locked=False
+    )
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert sql.endswith("FOR UPDATE OF task"), "Blocking mode is available"
+
+
 @pytest.mark.asyncio
 async def test_update_tasks(db_accessor):
     saved_pipeline = await store_me_a_pipeline(db_accessor)
@@ -225,14 +542,17 @@ async def test_update_tasks(db_accessor):
         ),
     )
 
-    saved_task.status = TaskStateEnum.DONE
+    with pytest.raises(TaskStateTransitionException):
+        saved_task.status = TaskStateEnum.DONE
+        await db_accessor.update_task(1, saved_task)
+    await db_accessor.claim_tasks(1, saved_pipeline, 1)
     modified_task = await db_accessor.update_task(1, saved_task)
 
     assert modified_task == saved_task
 
     events = await db_accessor.get_events_for_task(modified_task)
-    assert len(events) == 2, "Task was created, and then updated"
-    assert events[1].change == f"Task changed, new status {TaskStateEnum.DONE}"
+    assert len(events) == 3, "Task was created, claimed and then updated"
+    assert events[2].change == f"Task changed, new status {TaskStateEnum.DONE}"
 
     # Try to change a task that doesn't exist
     with pytest.raises(NoResultFound):
@@ -255,6 +575,182 @@ async def test_update_tasks(db_accessor):
         )
 
 
+@pytest.mark.asyncio
+async def test_update_task_state_transitions(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+    (task, _) = await db_accessor.create_task(
+        token_id=1,
+        task=Task(
+            task_input={"number": 1}, pipeline=pipeline, status=TaskStateEnum.PENDING
+        ),
+    )
+    await db_accessor.claim_tasks(1, pipeline, 1)
+
+    task.status = TaskStateEnum.RUNNING
+    updated = await db_accessor.update_task(
+        1, task, expected_status=TaskStateEnum.CLAIMED
+    )
+    assert updated.status == TaskStateEnum.RUNNING
+
+    # A second worker expecting the task to be claimed loses.
+    with pytest.raises(TaskStateTransitionException) as e:
+        await db_accessor.update_task(1, task, expected_status=TaskStateEnum.CLAIMED)
+    assert str(e.value) == "Task status is RUNNING, not CLAIMED"
+    # So does a second worker that does not say what it expects.
+    with pytest.raises(TaskStateTransitionException) as e:
+        await db_accessor.update_task(1, task)
+    assert str(e.value) == "Cannot change task status from RUNNING to RUNNING"
+
+    task.status = TaskStateEnum.CLAIMED
+    with pytest.raises(TaskStateTransitionException) as e:
+        await db_accessor.update_task(1, task)
+    assert str(e.value) == "Cannot change task status from RUNNING to CLAIMED"
+
+    with pytest.raises(TaskStateTransitionException):
+        await db_accessor.update_task_status(
+            1,
+            pipeline.name,
+            task.task_input_id,
+            TaskStateEnum.FAILED,
+            expected_status=TaskStateEnum.DONE,
+        )
+
+    await db_accessor.update_task_status(
+        1, pipeline.name, task.task_input_id, TaskStateEnum.DONE
+    )
+    with pytest.raises(TaskStateTransitionException):
+        await db_accessor.update_task_status(
+            1, pipeline.name, task.task_input_id, TaskStateEnum.FAILED
+        )
+
+    events = await db_accessor.get_events_for_task(task)
+    assert [e.change for e in events] == [
+        "Created",
+        "Task claimed",
+        f"Task changed, new status {TaskStateEnum.RUNNING}",
+        f"Task changed, new status {TaskStateEnum.DONE}",
+    ], "Rejected changes are not recorded"
+
+    results = await db_accessor.update_tasks(
+        1,
+        pipeline.name,
+        [
+            Task(
+                task_input={"number": 1},
+                pipeline=pipeline,
+                status=TaskStateEnum.RUNNING,
+            )
+        ],
+    )
+    assert results[0].updated is False
+    assert results[0].detail == "Cannot change task status from DONE to RUNNING"
+
+
+@pytest.mark.asyncio
+async def test_update_task_status(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+    (task, _) = await db_accessor.create_task(
+        token_id=1,
+        task=Task(
+            task_input={"number": 1}, pipeline=pipeline, status=TaskStateEnum.PENDING
+        ),
+    )
+    await db_accessor.claim_tasks(1, pipeline, 1, lease=60)
+
+    result = await db_accessor.update_task_status(
+        1, pipeline.name, task.task_input_id, TaskStateEnum.RUNNING
+    )
+    assert result.updated is True
+    assert result.status == TaskStateEnum.RUNNING
+    db_task = await db_accessor.get_db_task(pipeline.name, task.task_input_id)
+    assert db_task.state == TaskStateEnum.RUNNING
+    assert db_task.lease_expires is not None, "Lease is kept while running"
+
+    await db_accessor.update_task_status(
+        1, pipeline.name, task.task_input_id, TaskStateEnum.DONE
+    )
+    await db_accessor.session.refresh(db_task)
+    assert db_task.state == TaskStateEnum.DONE
+    assert db_task.lease_expires is None
+    assert db_task.updated is not None
+
+    events = await db_accessor.get_events_for_task(task)
+    assert [e.change for e in events][-2:] == [
+        f"Task changed, new status {TaskStateEnum.RUNNING}",
+        f"Task changed, new status {TaskStateEnum.DONE}",
+    ]
+
+    with pytest.raises(NoResultFound):
+        await db_accessor.update_task_status(
+            1, pipeline.name, "unknown", TaskStateEnum.DONE
+        )
+    with pytest.raises(NoResultFound):
+        await db_accessor.update_task_status(
+            1, "not here", task.task_input_id, TaskStateEnum.DONE
+        )
+
+
+@pytest.mark.asyncio
+async def test_update_tasks_in_bulk(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+
+    with pytest.raises(NoResultFound):
+        await db_accessor.update_tasks(1, "not here", [])
+
+    tasks = [
+        Task(task_input={"number": i}, pipeline=pipeline, status=TaskStateEnum.PENDING)
+        for i in range(4)
+    ]
+    await db_accessor.create_tasks(1, pipeline.name, tasks[:3])
+    (claimed, *_) = await db_accessor.claim_tasks(1, pipeline, 3, lease=60)
+
+    changes = [
+        Task(task_input={"number": 0}, pipeline=pipeline, status=TaskStateEnum.DONE),
+        Task(
+            task_input_id=tasks[1].generate_task_id(),
+            pipeline=pipeline,
+            status=TaskStateEnum.FAILED,
+        ),
+        Task(
+            task_input={"number": 2},
+            pipeline=pipeline,
+            status=TaskStateEnum.RUNNING,
+            priority=5,
+        ),
+        Task(task_input={"number": 3}, pipeline=pipeline, status=TaskStateEnum.DONE),
+        Task(task_input={"number": 2}, pipeline=pipeline, status=TaskStateEnum.DONE),
+    ]
+    results = await db_accessor.update_tasks(1, pipeline.name, changes)
+
+    assert [r.updated for r in results] == [True, True, False, False, True]
+    assert [r.task_input_id for r in results] == [
+        t.generate_task_id() for t in tasks + tasks[2:3]
+    ]
+    assert results[2].detail == "Superseded by a later change of the same task"
+    assert results[3].detail == "Task to be modified could not be found"
+
+    updated = {
+        t.task_input["number"]: t
+        for t in await db_accessor.get_tasks(pipeline_name=pipeline.name)
+    }
+    assert updated[0].status == TaskStateEnum.DONE
+    assert updated[1].status == TaskStateEnum.FAILED
+    assert updated[2].status == TaskStateEnum.DONE
+    assert updated[2].priority == 0, "Superseded change is not applied"
+
+    db_task = await db_accessor.get_db_task(
+        pipeline.name, job_descriptor=claimed.task_input_id
+    )
+    assert db_task.lease_expires is None, "Lease is cleared"
+
+    events = await db_accessor.get_events_for_task(updated[1])
+    assert [e.change for e in events] == [
+        "Created",
+        "Task claimed",
+        f"Task changed, new status {TaskStateEnum.FAILED}",
+    ]
+
+
 @pytest.mark.asyncio
 async def test_get_tasks(db_accessor):
     all_tasks = await db_accessor.get_tasks()
@@ -290,13 +786,14 @@ async def test_get_tasks(db_accessor):
     tasks = await db_accessor.get_tasks(pipeline_name="ptest one")
     assert len(tasks) == 2, "New tasks filtered out by pipeline name"
     assert tasks[0].pipeline.name == "ptest one"
+    assert tasks[0].pipeline is tasks[1].pipeline, "Tasks share the pipeline model"
+    assert tasks[0].status is TaskStateEnum.PENDING
+    assert tasks[0] == Task.model_validate(tasks[0].model_dump()), "Valid tasks"
 
     # Change one task to another status
-    await db_accessor.update_task(
-        token_id=1,
-        task=Task(
-            task_input={"number": 3}, pipeline=pipeline, status=TaskStateEnum.DONE
-        ),
+    await move_me_a_task(
+        db_accessor,
+        Task(task_input={"number": 3}, pipeline=pipeline, status=TaskStateEnum.DONE),
     )
 
     tasks = await db_accessor.get_tasks(task_status=TaskStateEnum.DONE)
@@ -311,6 +808,108 @@ async def test_get_tasks(db_accessor):
     assert len(tasks) == 0, 'Pipeline "ptest one" has no DONE tasks'
 
 
+@pytest.mark.asyncio
+async def test_get_task_page(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor, 2)
+    tasks = [
+        Task(task_input={"number": i}, pipeline=pipeline, status=TaskStateEnum.PENDING)
+        for i in range(5)
+    ]
+    # Tasks created together have the same creation time.
+    await db_accessor.create_tasks(1, pipeline.name, tasks)
+
+    pages = []
+    after = None
+    while True:
+        (page, after) = await db_accessor.get_task_page(
+            pipeline_name=pipeline.name, limit=2, after=after
+        )
+        pages.append([t.task_input["number"] for t in page])
+        if after is None:
+            break
+    assert pages == [[0, 1], [2, 3], [4]]
+
+    (page, after) = await db_accessor.get_task_page(
+        pipeline_name=pipeline.name, limit=5
+    )
+    assert len(page) == 5
+    assert after is None, "No next page if the last page is full"
+
+    (page, after) = await db_accessor.get_task_page(limit=100)
+    assert len(page) == 7, "All pipelines are listed"
+    assert after is None
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db_accessor.session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        await db_accessor.get_task_page(pipeline_name=pipeline.name, limit=2)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+    (sql,) = statements
+    where = sql.split("WHERE")[1]
+    assert "task.pipeline_id = " in where, "Tasks are selected by pipeline ID"
+    assert "pipeline.name" not in where
+
+    assert await db_accessor.get_task_page(pipeline_name="not here", limit=2) == (
+        [],
+        None,
+    )
+    assert await db_accessor.get_tasks(pipeline_name="not here") == []
+
+
+@pytest.mark.asyncio
+async def test_stream_tasks(db_accessor, monkeypatch):
+    monkeypatch.setattr(npg_porch.db.data_access, "STREAM_BATCH_SIZE", 2)
+    pipeline = await store_me_a_pipeline(db_accessor, 2)
+    tasks = [
+        Task(task_input={"number": i}, pipeline=pipeline, status=TaskStateEnum.PENDING)
+        for i in range(5)
+    ]
+    await db_accessor.create_tasks(1, pipeline.name, tasks)
+
+    batches = [
+        batch async for batch in db_accessor.stream_tasks(pipeline_name=pipeline.name)
+    ]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    streamed = [task for batch in batches for task in batch]
+    assert streamed == await db_accessor.get_tasks(pipeline_name=pipeline.name)
+
+    batches = [
+        batch
+        async for batch in db_accessor.stream_tasks(task_status=TaskStateEnum.DONE)
+    ]
+    assert batches == []
+
+
+@pytest.mark.asyncio
+async def test_get_task_fields(db_accessor):
+    tasks = await db_accessor.get_tasks(pipeline_name="ptest one")
+    fields = ["task_input_id", "status", "pipeline"]
+    projected = await db_accessor.get_tasks(pipeline_name="ptest one", fields=fields)
+    assert projected == [t.model_dump(include=set(fields)) for t in tasks]
+
+    (page, after) = await db_accessor.get_task_page(limit=1, fields=["priority"])
+    assert page == [{"priority": 0}]
+    assert after is not None
+
+    batches = [
+        batch async for batch in db_accessor.stream_tasks(fields=["task_input_id"])
+    ]
+    assert len(batches) == 1
+    assert sorted(t["task_input_id"] for t in batches[0]) == sorted(
+        t.task_input_id for t in tasks
+    ), "Listings are not ordered"
+
+    expanded = await db_accessor.get_expanded_tasks(fields=["created", "updated"])
+    assert [t.keys() for t in expanded] == [{"created", "updated"}] * len(tasks)
+    assert all(isinstance(t["updated"], datetime) for t in expanded)
+
+
 @pytest.mark.asyncio
 async def test_get_expanded_tasks(db_accessor, async_past_tasks):
     expanded_tasks = await db_accessor.get_expanded_tasks()
@@ -357,11 +956,9 @@ async def test_get_expanded_tasks(db_accessor, async_past_tasks):
     time.sleep(1)  # Delay to ensure a difference in time stamp
 
     # Change one task to another status
-    await db_accessor.update_task(
-        token_id=1,
-        task=Task(
-            task_input={"number": 1}, pipeline=pipeline, status=TaskStateEnum.DONE
-        ),
+    await move_me_a_task(
+        db_accessor,
+        Task(task_input={"number": 1}, pipeline=pipeline, status=TaskStateEnum.DONE),
     )
 
     expanded_tasks = await db_accessor.get_expanded_tasks()
@@ -383,6 +980,44 @@ async def test_get_expanded_tasks(db_accessor, async_past_tasks):
     ), "Specifying PENDING status returns only pending tasks"
 
 
+@pytest.mark.asyncio
+async def test_get_expanded_task_page(db_accessor, async_past_tasks):
+    all_tasks = await db_accessor.get_expanded_tasks()
+
+    (page, total, filtered) = await db_accessor.get_expanded_task_page(
+        start=2, length=3
+    )
+    assert total == filtered == len(all_tasks)
+    assert page == all_tasks[2:5], "Ordered by the last update by default"
+
+    (page, total, filtered) = await db_accessor.get_expanded_task_page(
+        order=[("pipeline.name", False), ("status", True)]
+    )
+    assert len(page) == total
+    keys = [(t.pipeline.name, t.status) for t in page]
+    by_status = sorted(keys, key=lambda k: k[1], reverse=True)
+    assert keys == sorted(by_status, key=lambda k: k[0])
+
+    (page, total, filtered) = await db_accessor.get_expanded_task_page(
+        pipeline_name="ptest one", search="done", length=100
+    )
+    assert total == len(await db_accessor.get_expanded_tasks("ptest one"))
+    assert filtered == 0
+
+    # The underscore is not a wildcard.
+    (page, total, filtered) = await db_accessor.get_expanded_task_page(
+        search="PTEST_ONE", fields=["pipeline"]
+    )
+    assert filtered == len(page) == 12
+    assert filtered < total
+    assert {t["pipeline"]["name"] for t in page} == {"ptest_one"}
+
+    (page, total, filtered) = await db_accessor.get_expanded_task_page(
+        search='"Shared"', status=[TaskStateEnum.DONE], start=0, length=10
+    )
+    assert filtered == len(page) == 3, "Task inputs are searched"
+
+
 @pytest.mark.asyncio
 async def test_count_tasks(db_accessor, async_tasks):
     task_count = await db_accessor.count_tasks()
@@ -390,6 +1025,169 @@ async def test_count_tasks(db_accessor, async_tasks):
     assert task_count == 12, "Tasks are counted correctly"
 
 
+@pytest.mark.asyncio
+async def test_pipeline_cache(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor, 5)
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db_accessor.session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        assert await db_accessor.get_pipeline_by_name(pipeline.name) == pipeline
+        assert len(statements) == 1, "The pipeline is looked up"
+        statements.clear()
+        assert await db_accessor.get_pipeline_by_name(pipeline.name) == pipeline
+        (task, created) = await db_accessor.create_task(
+            token_id=1,
+            task=Task(task_input={"number": 1}, pipeline=pipeline, status="PENDING"),
+        )
+        assert created
+        assert task.pipeline == pipeline
+        assert not [
+            s for s in statements if re.search(r"FROM pipeline\b", s)
+        ], "The pipeline is not looked up again"
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+
+    await db_accessor.session.execute(
+        update(DbPipeline)
+        .where(DbPipeline.name == pipeline.name)
+        .values(repository_uri="file:///elsewhere")
+    )
+    assert (
+        await db_accessor.get_pipeline_by_name(pipeline.name)
+    ).uri == pipeline.uri, "The cached pipeline is returned"
+    notifier.notify(PIPELINE_CHANNEL, pipeline.name)
+    assert (
+        await db_accessor.get_pipeline_by_name(pipeline.name)
+    ).uri == "file:///elsewhere", "The notification drops the cached pipeline"
+
+    with pytest.raises(NoResultFound):
+        await db_accessor.get_pipeline_by_name("not a pipeline")
+
+
+@pytest.mark.asyncio
+async def test_task_counters(db_accessor):
+    async def counted_states(pipeline_name):
+        result = await db_accessor.session.execute(
+            select(DbTask.state, count())
+            .join(DbTask.pipeline)
+            .where(DbPipeline.name == pipeline_name)
+            .group_by(DbTask.state)
+        )
+        return {row.state: row[1] for row in result}
+
+    async def counters(pipeline_name):
+        stats = await db_accessor.get_pipeline_stats(pipeline_name)
+        assert stats.total == sum(stats.counts.values())
+        return {state: n for (state, n) in stats.counts.items() if n}
+
+    pipeline = await store_me_a_pipeline(db_accessor)
+    await db_accessor.create_task(
+        1, Task(task_input={"number": 0}, pipeline=pipeline, status="PENDING")
+    )
+    await db_accessor.create_tasks(
+        1,
+        pipeline.name,
+        [
+            Task(task_input={"number": i}, pipeline=pipeline, status="PENDING")
+            for i in range(10)
+        ],
+    )
+    assert await counters(pipeline.name) == {TaskStateEnum.PENDING: 10}
+
+    claimed = await db_accessor.claim_tasks(1, pipeline, 6, lease=60)
+    claimed[0].status = TaskStateEnum.RUNNING
+    await db_accessor.update_task(1, claimed[0])
+    await db_accessor.update_task_status(
+        1, pipeline.name, claimed[1].task_input_id, TaskStateEnum.FAILED
+    )
+    for task in claimed[2:4]:
+        task.status = TaskStateEnum.DONE
+    claimed[4].status = TaskStateEnum.RUNNING
+    await db_accessor.update_tasks(1, pipeline.name, claimed[2:5])
+    await db_accessor.reap_expired_leases(datetime.now() + timedelta(seconds=120))
+
+    assert await counters(pipeline.name) == {
+        TaskStateEnum.PENDING: 7,
+        TaskStateEnum.FAILED: 1,
+        TaskStateEnum.DONE: 2,
+    }
+    assert await counters(pipeline.name) == await counted_states(pipeline.name)
+    assert await db_accessor.count_tasks() == 12
+    assert await db_accessor.count_tasks(pipeline.name, [TaskStateEnum.DONE]) == 2
+
+    with pytest.raises(NoResultFound):
+        await db_accessor.get_pipeline_stats("not here")
+
+
+@pytest.mark.asyncio
+async def test_task_duration_statistics(db_accessor):
+    pipeline = await store_me_a_pipeline(db_accessor)
+    tasks = [
+        Task(task_input={"number": i}, pipeline=pipeline, status="PENDING")
+        for i in range(5)
+    ]
+    await db_accessor.create_tasks(1, pipeline.name, tasks)
+    for i, minutes in enumerate([2, 5, 30, 90, 600]):
+        await db_accessor.session.execute(
+            update(DbTask)
+            .where(DbTask.job_descriptor == tasks[i].generate_task_id())
+            .values(created=datetime.now() - timedelta(minutes=minutes))
+        )
+    await db_accessor.session.commit()
+
+    for task in tasks:
+        task.status = TaskStateEnum.CLAIMED
+    await db_accessor.update_tasks(1, pipeline.name, tasks)
+    for task in tasks:
+        task.status = TaskStateEnum.DONE
+    await db_accessor.update_task(1, tasks[0])
+    await db_accessor.update_task_status(
+        1, pipeline.name, tasks[1].generate_task_id(), TaskStateEnum.DONE
+    )
+    await db_accessor.update_tasks(1, pipeline.name, tasks[2:])
+
+    result = await db_accessor.session.execute(
+        select(DbTask.created, DbTask.updated).join(DbTask.pipeline).where(
+            DbPipeline.name == pipeline.name
+        )
+    )
+    durations = [(row.updated - row.created).total_seconds() for row in result]
+    stats = (await db_accessor.get_pipeline_stats(pipeline.name)).durations
+
+    # Already DONE, not counted again. The update time of the task changes,
+    # so the durations are not computed from the tasks again.
+    await db_accessor.update_task(1, tasks[0])
+    assert (await db_accessor.get_pipeline_stats(pipeline.name)).durations == stats
+    assert stats.count == 5
+    assert stats.mean == pytest.approx(mean(durations))
+    assert stats.stdev == pytest.approx(stdev(durations))
+    assert stats.histogram == {
+        "1m": 0,
+        "10m": 2,
+        "1h": 1,
+        "6h": 1,
+        "1d": 1,
+        "7d": 0,
+        "longer": 0,
+    }
+
+    await db_accessor.session.run_sync(rebuild_task_durations)
+    rebuilt = (await db_accessor.get_pipeline_stats(pipeline.name)).durations
+    assert rebuilt.count == 5
+    assert rebuilt.mean == pytest.approx(stats.mean, abs=1)
+    assert rebuilt.histogram == stats.histogram
+
+    stats = (await db_accessor.get_pipeline_stats("ptest one")).durations
+    assert stats.count == 0
+    assert stats.mean is None and stats.stdev is None, "No DONE tasks"
+
+
 @pytest.mark.asyncio
 async def test_get_long_running_tasks(db_accessor):
     pipeline = await store_me_a_pipeline(db_accessor, 2)
@@ -409,9 +1207,9 @@ async def test_get_long_running_tasks(db_accessor):
 
     # Change task to done
     for i in range(2):
-        await db_accessor.update_task(
-            token_id=1,
-            task=Task(
+        await move_me_a_task(
+            db_accessor,
+            Task(
                 task_input={"number": i + 1},
                 pipeline=pipeline,
                 status=TaskStateEnum.DONE,
@@ -436,3 +1234,52 @@ async def test_get_long_running_tasks(db_accessor):
     long_running_tasks = await db_accessor.get_long_running_tasks()
 
     assert len(long_running_tasks) == 2, "A newer task is not long running"
+
+
+@pytest.mark.asyncio
+async def test_long_running_threshold(db_accessor):
+    "Tasks running for longer than the mean plus two standard deviations"
+
+    # Done tasks of the first pipeline took 600s on average with a standard
+    # deviation of 60s, tasks running for over 720s are long running. The
+    # second pipeline has a single done task, so no standard deviation.
+    pipelines = [await store_me_a_pipeline(db_accessor, i) for i in (3, 4)]
+    pipeline_ids = {}
+    for pipeline, (n, m2) in zip(pipelines, [(10, 9 * 60**2), (1, 0)]):
+        db_pipeline = await db_accessor._get_pipeline_db_object(pipeline.name)
+        pipeline_ids[pipeline.name] = db_pipeline.pipeline_id
+        db_accessor.session.add(
+            TaskDuration(pipeline_id=db_pipeline.pipeline_id, n=n, mean=600, m2=m2)
+        )
+    await db_accessor.session.commit()
+
+    now = datetime.now()
+    running_for = {
+        (pipelines[0].name, TaskStateEnum.RUNNING, 100): False,
+        (pipelines[0].name, TaskStateEnum.RUNNING, 700): False,
+        (pipelines[0].name, TaskStateEnum.RUNNING, 740): True,
+        (pipelines[0].name, TaskStateEnum.PENDING, 3600): True,
+        (pipelines[0].name, TaskStateEnum.DONE, 3600): False,
+        (pipelines[0].name, TaskStateEnum.CANCELLED, 3600): False,
+        (pipelines[1].name, TaskStateEnum.RUNNING, 3600): False,
+    }
+    for i, (name, state, seconds) in enumerate(running_for):
+        created = now - timedelta(seconds=seconds)
+        db_accessor.session.add(
+            DbTask(
+                pipeline_id=pipeline_ids[name],
+                job_descriptor=f"long running {i}",
+                definition={"number": i},
+                state=state,
+                created=created,
+                updated=created,
+            )
+        )
+    await db_accessor.session.commit()
+
+    long_running = await db_accessor.get_long_running_tasks()
+    assert sorted(
+        t.task_input["number"]
+        for t in long_running
+        if t.pipeline.name in pipeline_ids
+    ) == [i for i, key in enumerate(running_for) if running_for[key]]
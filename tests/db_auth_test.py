@@ -3,7 +3,12 @@ import datetime
 from sqlalchemy import select
 
 from npg_porch.db.models import Token, Pipeline
-from npg_porch.db.auth import Validator, CredentialsValidationException
+from npg_porch.db.auth import (
+    CredentialsValidationException,
+    PermissionCache,
+    Validator,
+)
+from npg_porch.db.notification import TOKEN_CHANNEL, notifier
 import npg_porch.models.permission
 import npg_porch.models.pipeline
 
@@ -94,3 +99,47 @@ async def test_permission_object_is_returned(async_minimum):
             assert p.pipeline is None
             assert p.requestor_id == t.token_id
             assert p.role == "power_user"
+
+
+@pytest.mark.asyncio
+async def test_permissions_are_cached(async_minimum):
+    v = Validator(session=async_minimum)
+    result = await async_minimum.execute(
+        select(Token).filter_by(description="Seqfarm host, job runner")
+    )
+    token_row = result.scalar_one()
+    p = await v.token2permission(token_row.token)
+
+    token_row.date_revoked = datetime.date(2022, 1, 1)
+    await async_minimum.commit()
+    assert await v.token2permission(token_row.token) == p, "Cached permission"
+
+    notifier.notify(TOKEN_CHANNEL, str(token_row.token_id))
+    with pytest.raises(
+        CredentialsValidationException, match=r"A revoked token is used"
+    ):
+        await v.token2permission(token_row.token)
+
+
+def test_permission_cache():
+    permissions = [
+        npg_porch.models.permission.Permission(role="power_user", requestor_id=i)
+        for i in range(3)
+    ]
+    cache = PermissionCache(ttl=60, size=2)
+    cache.put("a", permissions[0])
+    cache.put("b", permissions[1])
+    assert cache.get("a") == permissions[0]
+    cache.put("c", permissions[2])
+    assert cache.get("b") is None, "The least recently used token is dropped"
+    assert cache.get("a") == permissions[0]
+
+    cache.invalidate(2)
+    assert cache.get("c") is None
+    assert cache.get("a") == permissions[0]
+    cache.invalidate()
+    assert cache.get("a") is None
+
+    cache = PermissionCache(ttl=-1)
+    cache.put("a", permissions[0])
+    assert cache.get("a") is None, "Expired"
@@ -0,0 +1,36 @@
+import sqlalchemy
+from sqlalchemy import inspect
+
+from npg_porch.db.maintenance import upgrade_schema
+from npg_porch.db.models import Base
+
+
+def test_upgrade_schema(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite+pysqlite:///{tmp_path}/porch.db")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # Roll the schema back to before the task update time was added
+        conn.exec_driver_sql("DROP INDEX idx_updated_tasks")
+        conn.exec_driver_sql("DROP INDEX idx_state_updated_tasks")
+        conn.exec_driver_sql("DROP INDEX idx_task_events")
+        conn.exec_driver_sql("ALTER TABLE task DROP COLUMN updated")
+        conn.exec_driver_sql(
+            "CREATE INDEX idx_ordered_tasks ON task (pipeline_id, created)"
+        )
+
+    statements = upgrade_schema(engine)
+    assert statements == [
+        "ALTER TABLE task ADD COLUMN updated DATETIME",
+        "CREATE INDEX idx_state_updated_tasks ON task (state, updated)",
+        "CREATE INDEX idx_updated_tasks ON task (updated)",
+        "CREATE INDEX idx_task_events ON event (task_id, time, event_id)",
+        "DROP INDEX idx_ordered_tasks",
+    ]
+
+    inspector = inspect(engine)
+    assert "updated" in {c["name"] for c in inspector.get_columns("task")}
+    task_indexes = {i["name"] for i in inspector.get_indexes("task")}
+    assert {"idx_updated_tasks", "idx_state_updated_tasks"} <= task_indexes
+    assert "idx_ordered_tasks" not in task_indexes
+    assert upgrade_schema(engine) == [], "Nothing left to upgrade"
+    engine.dispose()
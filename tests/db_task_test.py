@@ -1,6 +1,7 @@
 import pytest
-from sqlalchemy import select
+from sqlalchemy import select, update
 
+from npg_porch.db.maintenance import backfill_task_updated
 from npg_porch.db.models import Task
 
 
@@ -24,3 +25,21 @@ async def test_task_creation(async_minimum):
     assert len(events) == 1
     assert events[0].change == "Created"
     assert events[0].token is not None
+
+
+def test_backfill_task_updated(sync_session, past_tasks, lots_of_tasks):
+    sync_session.add_all(past_tasks)
+    sync_session.add_all(lots_of_tasks)
+    sync_session.commit()
+    sync_session.execute(update(Task).values(updated=None))
+    sync_session.commit()
+
+    assert backfill_task_updated(sync_session, batch_size=5) == 22
+    assert backfill_task_updated(sync_session) == 0, "Nothing left to backfill"
+
+    sync_session.expire_all()
+    for task in sync_session.scalars(select(Task)):
+        if task.events:
+            assert task.updated == max(event.time for event in task.events)
+        else:
+            assert task.updated == task.created, "No events, creation time"
@@ -0,0 +1,29 @@
+from statistics import mean, variance
+
+import pytest
+
+from npg_porch.db.durations import (
+    DURATION_BUCKETS,
+    DurationSummary,
+    duration_bucket,
+    summarise_durations,
+)
+
+
+def test_summarise_durations():
+    durations = [3.0, 59.5, 60.0, 61.0, 4000.0, 10**7]
+    (summary, buckets) = summarise_durations(durations)
+    assert summary.n == 6
+    assert summary.mean == pytest.approx(mean(durations))
+    assert summary.variance() == pytest.approx(variance(durations))
+    assert buckets == {0: 3, 1: 1, 3: 1, 6: 1}
+
+    assert DurationSummary().variance() is None
+    assert summarise_durations([5.0])[0].variance() is None, "One duration"
+
+
+def test_duration_bucket():
+    assert duration_bucket(0) == 0
+    assert duration_bucket(60) == 0, "Upper bounds are inclusive"
+    assert duration_bucket(60.5) == 1
+    assert duration_bucket(7 * 24 * 3600 + 1) == len(DURATION_BUCKETS) - 1
@@ -7,6 +7,7 @@ from starlette.testclient import TestClient
 
 from npg_porch.db.models import Pipeline, Task, Event, Token
 from npg_porch.db.data_access import AsyncDbAccessor
+from npg_porch.db.maintenance import rebuild_task_counts, rebuild_task_durations
 from npg_porch.models import Task as ModelledTask, TaskStateEnum
 from npg_porch.server import app
 
@@ -124,14 +125,18 @@ def past_tasks():
             definition={"Shared": "input"},
             events=[day_one_events[i]],
             state=TaskStateEnum.PENDING,
+            updated=datetime.min,
         )
         for i in range(12)
     ]
 
     for i in range(3):
         tasks[i + 3].events.append(early_events[i])
+        tasks[i + 3].updated = EARLY
         tasks[i + 6].events.append(recent_events[i])
+        tasks[i + 6].updated = RECENT
         tasks[i + 9].events.append(now_events[i])
+        tasks[i + 9].updated = NOW
         index = 3 * (i + 1)
         tasks[index].state = TaskStateEnum.RUNNING
         index += 1
@@ -152,6 +157,8 @@ def past_tasks():
 def sync_minimum(sync_session, minimum_data):
     sync_session.add_all(minimum_data)
     sync_session.commit()
+    rebuild_task_counts(sync_session)
+    rebuild_task_durations(sync_session)
     return sync_session
 
 
@@ -159,6 +166,8 @@ def sync_minimum(sync_session, minimum_data):
 async def async_minimum(async_session, minimum_data):
     async_session.add_all(minimum_data)
     await async_session.commit()
+    await async_session.run_sync(rebuild_task_counts)
+    await async_session.run_sync(rebuild_task_durations)
     return async_session
 
 
@@ -166,6 +175,8 @@ async def async_minimum(async_session, minimum_data):
 async def async_tasks(async_session, lots_of_tasks):
     async_session.add_all(lots_of_tasks)
     await async_session.commit()
+    await async_session.run_sync(rebuild_task_counts)
+    await async_session.run_sync(rebuild_task_durations)
     return async_session
 
 
@@ -173,6 +184,8 @@ async def async_tasks(async_session, lots_of_tasks):
 async def async_past_tasks(async_session, past_tasks):
     async_session.add_all(past_tasks)
     await async_session.commit()
+    await async_session.run_sync(rebuild_task_counts)
+    await async_session.run_sync(rebuild_task_durations)
     return async_session
 
 
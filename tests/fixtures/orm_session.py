@@ -4,6 +4,8 @@ import pytest_asyncio
 import sqlalchemy
 import sqlalchemy.orm
 
+from npg_porch.db.auth import permission_cache
+from npg_porch.db.data_access import pipeline_cache
 from npg_porch.db.models import Base
 from npg_porch.db.connection import session_factory, deploy_schema, close_engine
 
@@ -47,3 +49,7 @@ async def async_session():
     yield session
     await session.close()
     await close_engine()
+    # Tokens of the next test might have the same strings but other IDs,
+    # the same goes for the names of pipelines.
+    permission_cache.invalidate()
+    pipeline_cache.invalidate()
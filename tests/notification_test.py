@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+import pytest
+
+from npg_porch.db.notification import Notifier
+
+
+@pytest.mark.asyncio
+async def test_waiter_is_woken():
+    notifier = Notifier()
+
+    with notifier.waiter("channel", "one") as woken:
+        notifier.notify("channel", "two")
+        notifier.notify("other channel", "one")
+        await asyncio.sleep(0.01)
+        assert not woken.done(), "Different notifications do not wake the waiter"
+
+        notifier.notify("channel", "one")
+        await asyncio.wait_for(woken, 1)
+
+    with notifier.waiter("channel", "one") as woken:
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(woken, 0.1)
+
+    assert notifier._waiters == {}, "Waiters are removed"
+
+
+@pytest.mark.asyncio
+async def test_notification_from_another_thread():
+    notifier = Notifier()
+
+    with notifier.waiter("channel", "one") as woken:
+        thread = threading.Thread(target=notifier.notify, args=("channel", "one"))
+        thread.start()
+        await asyncio.wait_for(woken, 1)
+        thread.join()
+
+
+def test_subscribers_are_called():
+    notifier = Notifier()
+    payloads = []
+    notifier.subscribe("channel", payloads.append)
+
+    notifier.notify("channel", "one")
+    notifier.notify("other channel", "two")
+    notifier.notify("channel", "three")
+    assert payloads == ["one", "three"]
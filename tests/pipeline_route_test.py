@@ -84,6 +84,19 @@ def test_get_known_pipeline(async_minimum, fastapi_testclient):
     assert response.json()["detail"] == "Pipeline 'not here' not found"
 
 
+def test_get_pipeline_stats(async_minimum, fastapi_testclient):
+    response = fastapi_testclient.get("/pipelines/ptest one/stats")
+    assert response.status_code == status.HTTP_200_OK
+    stats = response.json()
+    assert stats["pipeline"] == "ptest one"
+    assert stats["total"] == 2
+    assert stats["counts"]["PENDING"] == 2
+    assert stats["counts"]["DONE"] == 0, "All states are reported"
+
+    response = fastapi_testclient.get("/pipelines/not here/stats")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
 def test_create_pipeline(async_minimum, fastapi_testclient):
     invalid_pipeline = {
         "name": "ptest one",
@@ -1,6 +1,12 @@
+import json
 from datetime import datetime
 
-from npg_porch.models.task import TaskExpanded, TaskStateEnum
+from npg_porch.models.task import (
+    TaskExpanded,
+    TaskStateEnum,
+    allowed_previous_states,
+    is_allowed_transition,
+)
 from npg_porch.models import Pipeline
 
 
@@ -16,3 +22,40 @@ def test_expanded_task_date_format():
     )
     assert str(task.created) == "2025-01-01 00:00:00"
     assert str(task.updated) == "2025-01-02 12:30:15"
+    serialised = json.loads(task.model_dump_json())
+    assert serialised["created"] == "2025-01-01\u00a000:00:00"
+    assert serialised["updated"] == "2025-01-02\u00a012:30:15"
+    assert task.model_dump()["created"] == task.created, "Python dumps keep dates"
+
+    task = TaskExpanded(pipeline=pipeline, status=TaskStateEnum.PENDING)
+    assert json.loads(task.model_dump_json())["created"] is None
+
+
+def test_state_transitions():
+    for state in TaskStateEnum:
+        assert is_allowed_transition(state, TaskStateEnum.PENDING), "Can be rerun"
+        if state in (TaskStateEnum.CLAIMED, TaskStateEnum.RUNNING):
+            assert not is_allowed_transition(state, state), "Only one worker wins"
+        else:
+            assert is_allowed_transition(state, state), "Status can be repeated"
+
+    assert is_allowed_transition(TaskStateEnum.PENDING, TaskStateEnum.CLAIMED)
+    assert is_allowed_transition(TaskStateEnum.PENDING, TaskStateEnum.CANCELLED)
+    assert not is_allowed_transition(TaskStateEnum.PENDING, TaskStateEnum.RUNNING)
+    assert not is_allowed_transition(TaskStateEnum.PENDING, TaskStateEnum.DONE)
+
+    assert is_allowed_transition(TaskStateEnum.CLAIMED, TaskStateEnum.RUNNING)
+    assert is_allowed_transition(TaskStateEnum.RUNNING, TaskStateEnum.DONE)
+    assert is_allowed_transition(TaskStateEnum.RUNNING, TaskStateEnum.FAILED)
+    assert is_allowed_transition(TaskStateEnum.FAILED, TaskStateEnum.CANCELLED)
+    assert not is_allowed_transition(TaskStateEnum.RUNNING, TaskStateEnum.CLAIMED)
+    assert not is_allowed_transition(TaskStateEnum.DONE, TaskStateEnum.RUNNING)
+    assert not is_allowed_transition(TaskStateEnum.DONE, TaskStateEnum.FAILED)
+    assert not is_allowed_transition(TaskStateEnum.CANCELLED, TaskStateEnum.DONE)
+
+    assert allowed_previous_states(TaskStateEnum.CLAIMED) == [TaskStateEnum.PENDING]
+    assert allowed_previous_states(TaskStateEnum.DONE) == [
+        TaskStateEnum.CLAIMED,
+        TaskStateEnum.RUNNING,
+        TaskStateEnum.DONE,
+    ]
@@ -67,6 +67,59 @@ async def test_get_ui_tasks(db_accessor, async_past_tasks):
     ), "Three tasks are pending in new pipeline after task creation"
 
 
+@pytest.mark.asyncio
+async def test_get_ui_task_fields(db_accessor, async_past_tasks):
+    all_response = client.get(f"/ui/tasks/All/{ui.UiStateEnum.ALL}/{datetime.min}")
+    response = client.get(
+        f"/ui/tasks/All/{ui.UiStateEnum.ALL}/{datetime.min}",
+        params={"fields": ["task_input_id", "status", "updated"]},
+    )
+    assert response.status_code == 200
+    tasks = response.json()["data"]
+    assert tasks == [
+        {k: t[k] for k in ["task_input_id", "status", "updated"]}
+        for t in all_response.json()["data"]
+    ], "Same tasks in the same order, with the same date format"
+
+    response = client.get(
+        f"/ui/tasks/All/{ui.UiStateEnum.ALL}/{datetime.min}",
+        params={"fields": ["definition"]},
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_get_ui_tasks_server_side(db_accessor, async_past_tasks):
+    url = f"/ui/tasks/All/{ui.UiStateEnum.ALL}/{datetime.min}"
+    params = {
+        "draw": "2",
+        "start": "5",
+        "length": "4",
+        "columns[0][data]": "pipeline.name",
+        "columns[1][data]": "created",
+        "order[0][column]": "0",
+        "order[0][dir]": "desc",
+        "search[value]": "ptest_",
+    }
+    response = client.get(url, params=params)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["draw"] == "2"
+    assert result["recordsTotal"] == 14
+    assert result["recordsFiltered"] == 12
+    assert len(result["data"]) == 4
+    assert {t["pipeline"]["name"] for t in result["data"]} == {"ptest_one"}
+
+    params["search[value]"] = ""
+    params["start"] = "0"
+    params["length"] = "-1"
+    response = client.get(url, params=params)
+    result = response.json()
+    assert result["recordsTotal"] == result["recordsFiltered"] == 14
+    names = [t["pipeline"]["name"] for t in result["data"]]
+    assert names == sorted(names, reverse=True)
+
+
 @pytest.mark.asyncio
 async def test_get_long_running_ui_tasks(db_accessor):
     modelled_pipeline = Pipeline(
@@ -85,14 +138,15 @@ async def test_get_long_running_ui_tasks(db_accessor):
         )
 
     for i in range(2):
-        await db_accessor.update_task(
-            token_id=1,
-            task=Task(
-                task_input={"number": i + 1},
-                pipeline=pipeline,
-                status=TaskStateEnum.DONE,
-            ),
-        )
+        for task_status in (TaskStateEnum.CLAIMED, TaskStateEnum.DONE):
+            await db_accessor.update_task(
+                token_id=1,
+                task=Task(
+                    task_input={"number": i + 1},
+                    pipeline=pipeline,
+                    status=task_status,
+                ),
+            )
 
     response = client.get("/ui/long_running")
 